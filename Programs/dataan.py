@@ -15,8 +15,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import os
-import glob
 from tqdm import tqdm
+import vinalog
+from results_index import ResultsIndex
+import leaderboard
+import results_store
+import pose_cluster
 
 def print_purple(text):
     print("\033[95m {}\033[00m" .format(text))
@@ -47,21 +51,46 @@ def get_log_directory():
     log_dir = input("Please enter the directory containing the log files: ")
     return log_dir
 
-def parse_log_files(log_dir):
+def parse_log_file(log_file):
+    """Return (cid, best affinity) from one Vina log, or None if it has no result."""
+    return vinalog.best_affinity(log_file)
+
+def parse_master_log(master_log):
+    """Read (cid, best affinity) for every ligand from master_log.log in one pass."""
+    best = {}
+    for ligand, affinity in tqdm(vinalog.iter_master_log(master_log), desc="Parsing master log"):
+        best[vinalog.cid_from_log(ligand)] = affinity  # a re-docked ligand's latest entry wins
+    return list(best.items())
+
+def parse_log_files(log_dir, jobs=None):
+    """Parse every *.pdbqt_log.log in log_dir across a process pool.
+
+    Falls back to master_log.log when the directory has no per-ligand logs.
+    """
     results = []
-    log_files = glob.glob(os.path.join(log_dir, '*.pdbqt_log.log'))
-    for log_file in tqdm(log_files, desc="Parsing log files"):
-        try:
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-            cid = os.path.basename(log_file).split('.')[0]
-            for line in lines:
-                if line.strip().startswith('1'):
-                    affinity = float(line.split()[1])
-                    results.append((cid, affinity))
-                    break
-        except Exception as e:
-            print(f"Error reading file {log_file}: {str(e)}")
+    def on_error(log_file, message):
+        print(f"Error reading file {log_file}: {message}")
+    with tqdm(desc="Parsing log files", unit=" files") as progress:
+        for count, chunk_results in vinalog.parse_logs(vinalog.iter_log_files(log_dir), jobs, on_error=on_error):
+            results.extend(chunk_results)
+            progress.update(count)
+        parsed = progress.n
+    master_log = os.path.join(log_dir, 'master_log.log')
+    if parsed == 0 and os.path.exists(master_log):
+        results = parse_master_log(master_log)
+    return results
+
+def analyse_directory(log_dir, jobs=None):
+    """Rank every ligand in log_dir, parsing only logs that are new or changed since the last run."""
+    index = ResultsIndex(log_dir)
+    try:
+        index.update(jobs)
+        results = index.ranking()
+    finally:
+        index.close()
+    master_log = os.path.join(log_dir, 'master_log.log')
+    if not results and os.path.exists(master_log):
+        results = parse_master_log(master_log)
     return results
 
 def write_results(results, log_dir):
@@ -82,6 +111,14 @@ def write_results(results, log_dir):
 if __name__ == "__main__":
     display_intro()
     log_dir = get_log_directory()  # get directory from user
-    results = parse_log_files(log_dir)
+    if input("Watch a docking run that is still in progress? (Y/N): ").strip().upper() == 'Y':
+        leaderboard.watch(log_dir)
+    results = analyse_directory(log_dir)
     write_results(results, log_dir)
+    store = results_store.ResultsStore.from_log_dir(log_dir)
+    store.save(os.path.join(log_dir, results_store.STORE_FILE))
+    print(f"All {len(store)} poses saved to {results_store.STORE_FILE} for analysis with results_store.py")
+    if input("Cluster the docked poses as well? (Y/N): ").strip().upper() == 'Y':
+        out_dir = input("Directory containing the *_out.pdbqt files (press Enter for the log directory): ").strip() or log_dir
+        pose_cluster.cluster_directory(out_dir)
 
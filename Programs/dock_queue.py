@@ -0,0 +1,298 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Multi-node docking work queue.
+
+The coordinator runs in the docking working directory and hands out batches of
+ligands from ligands.txt over TCP. Workers on any host lease a batch, dock it
+with Vina and send back the logs and poses, which the coordinator writes in the
+usual layout. Workers heartbeat while they dock; a batch whose lease expires is
+put back in the queue for another worker. With --shared, every node sees the
+working directory on a shared filesystem, so only ligand names travel over the
+socket and workers read and write the files in place.
+
+    python3 Programs/dock_queue.py coordinator --port 5000
+    python3 Programs/dock_queue.py worker coordinator-host:5000 --jobs 4
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import vina_engine
+from job_ledger import JobLedger, DONE, FAILED, PENDING
+
+DEFAULT_PORT = 5000
+LEASE_SECONDS = 600
+BATCH_SIZE = 8
+
+def request(address, message):
+    """Send one JSON message to the coordinator and return its JSON reply."""
+    with socket.create_connection(address, timeout=60) as sock:
+        sock.sendall((json.dumps(message) + '\n').encode())
+        with sock.makefile('r') as reply:
+            return json.loads(reply.readline())
+
+def read_text(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+def staged_name(path):
+    """Relative name for a file the coordinator names, safe to create under a worker's scratch folder."""
+    parts = [part for part in path.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return os.path.join(*parts) if parts else "unnamed"
+
+def with_option(conf_text, key, value):
+    """conf.txt text with its key= option set to value."""
+    lines = [line for line in conf_text.splitlines() if line.split('#', 1)[0].split('=', 1)[0].strip() != key]
+    return '\n'.join([f"{key} = {value}"] + lines) + '\n'
+
+class Coordinator:
+    """Queue state: pending ligands, leases held by workers and finished ligands."""
+
+    def __init__(self, ligands, conf_file=vina_engine.CONF_FILE, shared=False, lease_seconds=LEASE_SECONDS, ledger=None):
+        self.conf_file = conf_file
+        self.shared = shared
+        self.lease_seconds = lease_seconds
+        self.ledger = ledger
+        self.inputs = vina_engine.input_digests(ligands, conf_file) if ledger is not None else {}
+        if ledger is not None:
+            ligands = [ligand for ligand in ligands if ledger.needs_docking(ligand, self.inputs[ligand])]
+            ledger.mark_many(ligands, PENDING, self.inputs)
+        self.total = len(ligands)
+        self.ligands = set(ligands)
+        self.pending = deque(ligands)
+        self.leases = {}  # ligand -> (worker, expiry time)
+        self.finished = set()
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        self.master = open(vina_engine.MASTER_LOG, 'a')
+        if not ligands:
+            self.all_done.set()
+
+    def hello(self, message):
+        receptor = vina_engine.receptor_path(self.conf_file)
+        reply = {"shared": self.shared, "lease_seconds": self.lease_seconds, "receptor_name": receptor}
+        if not self.shared:
+            reply["receptor_name"] = staged_name(receptor)
+            reply["conf"] = with_option(read_text(self.conf_file), "receptor", reply["receptor_name"])
+            reply["receptor"] = read_text(receptor)
+        return reply
+
+    def expire_leases(self):
+        now = time.time()
+        for ligand, (worker, expiry) in list(self.leases.items()):
+            if expiry < now:
+                del self.leases[ligand]
+                self.pending.appendleft(ligand)
+                print(f"Lease of {ligand} held by {worker} expired, requeued")
+
+    def lease(self, message):
+        worker, count = message["worker"], message.get("count", BATCH_SIZE)
+        jobs = []
+        with self.lock:
+            self.expire_leases()
+            expiry = time.time() + self.lease_seconds
+            while self.pending and len(jobs) < count:
+                ligand = self.pending.popleft()
+                if ligand in self.finished:
+                    continue
+                self.leases[ligand] = (worker, expiry)
+                jobs.append({"ligand": ligand, "content": None if self.shared else read_text(ligand)})
+            done = not self.pending and not self.leases
+        return {"jobs": jobs, "done": done}
+
+    def heartbeat(self, message):
+        with self.lock:
+            expiry = time.time() + self.lease_seconds
+            for ligand, (worker, _) in self.leases.items():
+                if worker == message["worker"]:
+                    self.leases[ligand] = (worker, expiry)
+        return {"ok": True}
+
+    def complete(self, message):
+        """Record the results of a batch; only ligands leased to the sending worker are accepted."""
+        worker = message["worker"]
+        rejected = []
+        with self.lock:
+            for result in message["results"]:
+                ligand = result["ligand"]
+                if ligand in self.finished:
+                    continue  # a slow worker finishing a lease that was already redone
+                if ligand not in self.ligands or self.leases.get(ligand, (None, 0))[0] != worker:
+                    rejected.append(ligand)  # never queued, or its lease expired and went to another worker
+                    continue
+                del self.leases[ligand]
+                self.finished.add(ligand)
+                if not self.shared:
+                    vina_engine.write_atomic(vina_engine.log_path(ligand), result["log"])
+                    if result.get("pose") is not None:
+                        vina_engine.write_atomic(vina_engine.out_path(ligand), result["pose"])
+                self.master.write(vina_engine.master_log_entry(ligand, result["log"]))
+                if self.ledger is not None:
+                    self.ledger.mark(ligand, DONE if result["returncode"] == 0 else FAILED, self.inputs[ligand])
+            self.master.flush()
+            print(f"{len(self.finished)}/{self.total} ligands docked")
+            if rejected:
+                print(f"Ignored {len(rejected)} results from {worker} for ligands it does not hold a lease on")
+            if len(self.finished) >= self.total:
+                self.all_done.set()
+        return {"ok": True, "rejected": rejected}
+
+    def close(self):
+        self.master.close()
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        coordinator = self.server.coordinator
+        handlers = {"hello": coordinator.hello, "lease": coordinator.lease,
+                    "heartbeat": coordinator.heartbeat, "complete": coordinator.complete}
+        try:
+            reply = handlers[message["op"]](message)
+        except Exception as e:
+            reply = {"error": str(e)}
+        self.wfile.write((json.dumps(reply) + '\n').encode())
+
+def serve(ligands, port=DEFAULT_PORT, host="0.0.0.0", **options):
+    """Run a coordinator until every ligand has been docked by some worker."""
+    coordinator = Coordinator(ligands, **options)
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((host, port), CoordinatorHandler)
+    server.daemon_threads = True
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Coordinator listening on port {server.server_address[1]} with {coordinator.total} ligands to dock")
+    coordinator.all_done.wait()
+    time.sleep(1)  # let idle workers hear that the queue is finished
+    server.shutdown()
+    server.server_close()
+    coordinator.close()
+    print("All ligands docked.")
+
+def run_worker(address, jobs=1, cpu=None, batch_size=BATCH_SIZE, workdir=None, poll_seconds=5):
+    """Pull ligand batches from a coordinator and dock them until the queue is finished."""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    info = request(address, {"op": "hello"})
+    scratch = None
+    if info["shared"]:
+        os.chdir(workdir or '.')
+    else:
+        scratch = tempfile.mkdtemp(prefix="reshelp_worker_", dir=workdir)
+        os.chdir(scratch)
+        receptor = staged_name(info["receptor_name"])
+        os.makedirs(os.path.dirname(receptor) or '.', exist_ok=True)
+        with open(vina_engine.CONF_FILE, 'w') as f:
+            f.write(with_option(info["conf"], "receptor", receptor))
+        with open(receptor, 'w') as f:
+            f.write(info["receptor"])
+
+    stop = threading.Event()
+    def keep_alive():
+        while not stop.wait(max(1, info["lease_seconds"] / 3)):
+            try:
+                request(address, {"op": "heartbeat", "worker": worker_id})
+            except OSError:
+                pass
+
+    def dock(job):
+        if job["content"] is None:
+            returncode, log = vina_engine.run_vina(job["ligand"], vina_engine.CONF_FILE, cpu)
+            return {"ligand": job["ligand"], "returncode": returncode, "log": log}
+        # each ligand gets its own folder in scratch, so names from the coordinator cannot clash or escape it
+        job_dir = tempfile.mkdtemp(prefix="job_", dir='.')
+        try:
+            ligand = os.path.join(job_dir, staged_name(job["ligand"]))
+            os.makedirs(os.path.dirname(ligand), exist_ok=True)
+            with open(ligand, 'w') as f:
+                f.write(job["content"])
+            returncode, log = vina_engine.run_vina(ligand, vina_engine.CONF_FILE, cpu)
+            out_file = vina_engine.out_path(ligand)
+            pose = read_text(out_file) if os.path.exists(out_file) else None
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return {"ligand": job["ligand"], "returncode": returncode, "log": log, "pose": pose}
+
+    threading.Thread(target=keep_alive, daemon=True).start()
+    docked = 0
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                try:
+                    batch = request(address, {"op": "lease", "worker": worker_id, "count": batch_size * jobs})
+                except OSError:
+                    break  # coordinator is gone, the queue is finished
+                if not batch["jobs"]:
+                    if batch["done"]:
+                        break
+                    time.sleep(poll_seconds)  # remaining ligands are leased to other workers
+                    continue
+                results = list(executor.map(dock, batch["jobs"]))
+                try:
+                    request(address, {"op": "complete", "worker": worker_id, "results": results})
+                except OSError as e:
+                    print(f"Could not send {len(results)} results to the coordinator ({e}), stopping")
+                    break  # the leases expire and the coordinator hands the batch to another worker
+                docked += len(results)
+    finally:
+        stop.set()
+        if scratch is not None:
+            os.chdir(os.path.dirname(scratch))
+            shutil.rmtree(scratch, ignore_errors=True)
+    print(f"Worker {worker_id} docked {docked} ligands")
+    return docked
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or "localhost", int(port)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distribute Vina docking over several machines")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinator", help="serve ligands.txt from the current working directory")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--ligands", default=vina_engine.LIGAND_LIST)
+    coordinator.add_argument("--conf", default=vina_engine.CONF_FILE)
+    coordinator.add_argument("--lease", type=int, default=LEASE_SECONDS, help="seconds before an unfinished batch is requeued")
+    coordinator.add_argument("--shared", action="store_true", help="workers see this directory on a shared filesystem")
+    worker = commands.add_parser("worker", help="dock ligands handed out by a coordinator")
+    worker.add_argument("address", help="coordinator host:port")
+    worker.add_argument("--jobs", type=int, default=1, help="parallel Vina processes on this worker")
+    worker.add_argument("--cpu", type=int, default=None, help="cpu= per Vina process")
+    worker.add_argument("--batch", type=int, default=BATCH_SIZE, help="ligands leased per Vina job slot")
+    worker.add_argument("--workdir", default=None, help="shared working directory (with --shared) or scratch location")
+    args = parser.parse_args(argv)
+
+    if args.command == "coordinator":
+        ledger = JobLedger()
+        try:
+            serve(vina_engine.read_ligand_list(args.ligands), port=args.port, conf_file=args.conf,
+                  shared=args.shared, lease_seconds=args.lease, ledger=ledger)
+        finally:
+            ledger.close()
+    else:
+        run_worker(parse_address(args.address), jobs=args.jobs, cpu=args.cpu, batch_size=args.batch, workdir=args.workdir)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,9 +16,19 @@ limitations under the License.
 """
 
 import os
+import shutil
 import subprocess
 import glob
 import sys
+import vina_engine
+import ligand_prep
+import ligand_filter
+import poses
+import pipeline
+import screening
+from job_ledger import JobLedger
+from result_cache import ResultCache
+from log_archive import LogArchive
 
 def print_purple(text):
     print("\033[95m {}\033[00m" .format(text))
@@ -84,16 +94,27 @@ def confirm_files_presence():
 def energy_minimize(directory):
     os.chdir(directory)
     """Start the docking process."""
-    input("Press Enter to start the docking process...")
-    subprocess.run(["obminimize -ff MMFF94 -n 1000 *.sdf"], shell=True)
+    response = input("Do you want to drop oversized, flexible, disconnected and duplicate ligands first? (Y/N): ").strip().upper()
+    if response == 'Y':
+        ligand_filter.prefilter_sdf_files(sorted(glob.glob("*.sdf")))
+    input("Press Enter to start the energy minimization...")
+    ligand_prep.minimize_ligands(sorted(glob.glob("*.sdf")))
 
 def convert_to_pdbqt(directory):
     os.chdir(directory)
     """Convert ligands to .pdbqt format."""
     response = input("Do you want to convert the energy minimized ligands to .pdbqt format? (Y/N): ").strip().upper()
     if response == 'Y':
-        subprocess.run(["obabel -isdf *.sdf -opdbqt -O*.pdbqt"], shell=True)
-        subprocess.run(["ls *.pdbqt > ligands.txt"], shell=True)
+        sdf_files = ligand_prep.minimized_files(sorted(glob.glob("*.sdf")))
+        library = input("Stream multi-record SDF libraries into sharded folders instead? (Y/N): ").strip().upper()
+        if library == 'Y':
+            ligand_prep.convert_sdf_library(sdf_files)
+        else:
+            for sdf_file in sdf_files:
+                error = ligand_prep.convert_ligand(sdf_file, os.path.splitext(os.path.basename(sdf_file))[0] + ".pdbqt")
+                if error:
+                    print(f"Could not convert {sdf_file}: {error}")
+            subprocess.run(["ls *.pdbqt > ligands.txt"], shell=True)
 
 def start_docking(directory):
     os.chdir(directory)
@@ -101,31 +122,120 @@ def start_docking(directory):
     response = input("Do you want to start the docking process? (Y/N): ").strip().upper()
     if response == 'Y':
         os.chdir(directory)
-        subprocess.run(["perl", "vina_modified.pl"])
-        os.makedirs("Log", exist_ok=True)
+        jobs = input("Number of parallel Vina jobs (press Enter to split the cpu= budget automatically, or 'tune' to calibrate on a sample): ").strip()
+        ligands = vina_engine.read_ligand_list(vina_engine.LIGAND_LIST)
+        batch_size = input("Ligands per Vina process (press Enter for 1, larger values need Vina 1.2 --batch): ").strip()
+        use_cache = input("Reuse results from the shared docking cache? (Y/N): ").strip().upper() == 'Y'
+        use_archive = input("Keep the Vina logs in one compressed logs.archive instead of separate files? (Y/N): ").strip().upper() == 'Y'
+        ledger = JobLedger()
+        cache = ResultCache() if use_cache else None
+        archive = LogArchive() if use_archive else None
+        try:
+            batch_size = int(batch_size) if batch_size.isdigit() else 1
+            if jobs.lower() == 'tune':
+                vina_engine.dock_ligands_autotuned(ligands, vina_engine.CONF_FILE, ledger=ledger, cache=cache, batch_size=batch_size,
+                                                   archive=archive)
+            else:
+                vina_engine.dock_ligands(ligands, vina_engine.CONF_FILE, jobs=int(jobs) if jobs.isdigit() else None, ledger=ledger, cache=cache,
+                                         batch_size=batch_size, archive=archive)
+        finally:
+            ledger.close()
+            if cache is not None:
+                cache.close()
+            if archive is not None:
+                archive.close()
+                print("Logs saved in logs.archive, run 'python3 Programs/log_archive.py export Log' to write them out as files.")
         os.makedirs("Output", exist_ok=True)
-        subprocess.run("mv *.log Log", shell=True)
+        collect_logs("Log")
 
 def split_output_files(directory):
     os.chdir(directory)
     """split output pdbqt files into docking poses"""
     response = input("Do you want to split the output files into docking poses? (Y/N): ").strip().upper()
     if response == 'Y':
-        output_files = glob.glob("*_out.pdbqt")
-        for output_file in output_files:
-            subprocess.run(["vina_split", "--input", output_file])
-        os.makedirs("01_Docking_Pose", exist_ok=True)
-        os.makedirs("Other_Docking_Pose", exist_ok=True)
+        output_files = glob.glob("*_out.pdbqt") + glob.glob(os.path.join(ligand_prep.SHARD_DIR, "*", "*_out.pdbqt"))
+        poses.split_pose_files(output_files, "01_Docking_Pose", "Other_Docking_Pose")
         os.makedirs("Input", exist_ok=True)
         os.makedirs("PDBQT", exist_ok=True)
-        subprocess.run(["mv *_ligand_01.pdbqt 01_Docking_Pose"], shell=True)
-        subprocess.run(["mv *_ligand_02.pdbqt Other_Docking_Pose && mv *_ligand_03.pdbqt Other_Docking_Pose && mv *_ligand_04.pdbqt Other_Docking_Pose && mv *_ligand_05.pdbqt Other_Docking_Pose && mv *_ligand_06.pdbqt Other_Docking_Pose && mv *_ligand_07.pdbqt Other_Docking_Pose && mv *_ligand_08.pdbqt Other_Docking_Pose && mv *_ligand_09.pdbqt Other_Docking_Pose && mv *_ligand_10.pdbqt Other_Docking_Pose"], shell=True)
-        subprocess.run(["mv *.sdf Input && mv protein.pdbqt Input"], shell=True)
-        subprocess.run(["mv 01_Docking_Pose Output"], shell=True)
-        subprocess.run(["mv Other_Docking_Pose Output"], shell=True)
-        subprocess.run(["mv Log Output"], shell=True)
-        subprocess.run(["mv *.pdbqt PDBQT"], shell=True)
-        subprocess.run(["mv PDBQT Output"], shell=True)
+        os.makedirs("Output", exist_ok=True)
+        move_matching("*.sdf", "Input")
+        move_matching("protein.pdbqt", "Input")
+        move_matching("01_Docking_Pose", "Output")
+        move_matching("Other_Docking_Pose", "Output")
+        move_matching("Log", "Output")
+        move_matching("*.pdbqt", "PDBQT")
+        move_matching("PDBQT", "Output")
+
+def collect_logs(destination):
+    """Move the Vina logs of the working directory and of every PDBQT shard folder into destination.
+
+    Shards only keep ligand names unique within themselves, so a log whose name
+    is already taken gets its shard folder appended to its name.
+    """
+    os.makedirs(destination, exist_ok=True)
+    move_matching("*.log", destination)
+    for path in sorted(glob.glob(os.path.join(ligand_prep.SHARD_DIR, "*", "*.log"))):
+        name = os.path.basename(path)
+        target = os.path.join(destination, name)
+        if os.path.exists(target):
+            stem, _, rest = name.partition('.')
+            target = os.path.join(destination, f"{stem}_{os.path.basename(os.path.dirname(path))}.{rest}")
+        shutil.move(path, target)
+
+def move_matching(pattern, destination):
+    """Move everything matching pattern into destination without going through the shell."""
+    for path in glob.glob(pattern):
+        shutil.move(path, os.path.join(destination, os.path.basename(path)))
+
+def ask_redock_count():
+    """Ask how many ligands tier 2 re-docks; returns the top_k or top_percent option for tiered_screen."""
+    while True:
+        top = input("How many ligands to re-dock? Enter a count, or a percentage such as 1%: ").strip()
+        if top.isdigit() and int(top) > 0:
+            return {"top_k": int(top)}
+        if top.endswith('%'):
+            try:
+                percent = float(top[:-1])
+            except ValueError:
+                percent = 0
+            if 0 < percent <= 100:
+                return {"top_percent": percent}
+        print("Please enter a positive whole number, or a percentage between 0 and 100 such as 1%.")
+
+def start_tiered_screening(directory):
+    """Dock everything with a fast search, then re-dock the best ligands at full exhaustiveness."""
+    os.chdir(directory)
+    response = input("Do you want to start a two-stage (tiered) screening? (Y/N): ").strip().upper()
+    if response == 'Y':
+        top = ask_redock_count()
+        ligands = vina_engine.read_ligand_list(vina_engine.LIGAND_LIST)
+        screening.tiered_screen(ligands, vina_engine.CONF_FILE, **top)
+
+def start_ensemble_docking(directory):
+    """Dock the ligand set against every receptor listed in receptors.txt from one shared queue."""
+    os.chdir(directory)
+    if not os.path.exists(screening.RECEPTOR_LIST):
+        print(f"{screening.RECEPTOR_LIST} not found. Add one line per receptor: name receptor.pdbqt conf.txt")
+        return
+    response = input("Do you want to start ensemble docking against every receptor in receptors.txt? (Y/N): ").strip().upper()
+    if response == 'Y':
+        jobs = input("How many receptor-ligand pairs should dock in parallel? (press Enter for automatic): ").strip()
+        use_cache = input("Reuse cached results for unchanged receptor/ligand/box inputs? (Y/N): ").strip().upper() == 'Y'
+        cache = ResultCache() if use_cache else None
+        try:
+            screening.dock_matrix(vina_engine.read_ligand_list(vina_engine.LIGAND_LIST), screening.read_receptor_list(),
+                                  jobs=int(jobs) if jobs.isdigit() else None, cache=cache)
+        finally:
+            if cache is not None:
+                cache.close()
+
+def run_pipeline_from_config():
+    """Run the headless minimize -> convert -> dock -> split pipeline from a config file."""
+    config_file = input("Enter the path to the pipeline config file: ").strip()
+    try:
+        pipeline.run_pipeline(pipeline.read_pipeline_config(config_file))
+    except FileNotFoundError as e:
+        print(e)
    
 def display_options():
     print("Available Actions:")
@@ -135,14 +245,17 @@ def display_options():
     print("4. Convert .sdf ligands to .pdbqt")
     print("5. Start docking process")
     print("6. Split output files")
-    print("7. Exit")
+    print("7. Run headless pipeline from a config file")
+    print("8. Two-stage screening (fast pass, then re-dock the best)")
+    print("9. Ensemble docking (many receptors)")
+    print("10. Exit")
 
     print("\n")
 
 def ask_for_tool_choice():
     while True:
         print()
-        choice = input("Enter the serial number of the action you want to perform (or 7 to exit): ")
+        choice = input("Enter the serial number of the action you want to perform (or 10 to exit): ")
         if choice.isdigit():
             choice = int(choice)
             if choice == 1:
@@ -159,6 +272,12 @@ def ask_for_tool_choice():
             elif choice == 6:
                 split_output_files(wd1)
             elif choice == 7:
+                run_pipeline_from_config()
+            elif choice == 8:
+                start_tiered_screening(wd1)
+            elif choice == 9:
+                start_ensemble_docking(wd1)
+            elif choice == 10:
                 print("Exiting...")
                 sys.exit()
             else:
@@ -16,22 +16,12 @@ limitations under the License.
 """
 
 import os
-import requests
-import time
-from concurrent.futures import ThreadPoolExecutor
-from urllib.parse import quote_plus
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+import pubchem
 from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog, QLabel, QTextEdit, QLineEdit, QProgressBar, QMessageBox, QComboBox, QHBoxLayout
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QMetaObject 
 from PyQt6.QtGui import QIcon, QFont, QPalette, QColor
 import sys 
 
-MAX_RETRIES = 20
-RETRY_DELAY = 3  # Delay between retries in seconds
-MAX_CONCURRENT_REQUESTS = 10 # Maximum number of concurrent requests
-THROTTLING_DELAY = 0.2  # Delay between each concurrent request in seconds
-
 class DownloadThread(QThread):
     progress = pyqtSignal(int)
     finished = pyqtSignal(int, int)  # Signal to indicate download finished with success and error counts
@@ -48,89 +38,18 @@ class DownloadThread(QThread):
         self.progress.emit(value)
 
     def run(self):
-        total_chemicals = len(self.names)
-        downloaded_count = 0
-        error_count = 0
-
-        log_file = os.path.join(self.save_folder, "download_errors.log")
-        cid_list_file = os.path.join(self.save_folder, "cid_list.txt")
-
-        with open(cid_list_file, 'w') as cid_file:
-            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
-                futures = []
-                for name in self.names:
-                    name = name.strip()  # Remove leading/trailing whitespace and newline characters
-                    if self.is_retry:
-                        url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{name}/record/{self.file_type}/?record_type=3d"
-                        future = executor.submit(self.download_file, url, self.save_folder, f"{name}.{self.file_type}", log_file)
-                    else:
-                        url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/{quote_plus(name)}/cids/JSON?name_type=word"
-                        future = executor.submit(self.download_and_track_progress, url, self.save_folder, self.file_type, log_file, cid_file)
-                    futures.append(future)
-                    time.sleep(THROTTLING_DELAY)  # Introduce a delay between each concurrent request
-                
-                for future in futures:
-                    result = future.result()
-                    if result:
-                        downloaded_count += 1
-                    else:
-                        error_count += 1
-                    self.update_progress(int((downloaded_count + error_count) / total_chemicals * 100))
-            
-        self.finished.emit(downloaded_count, error_count)
+        total_chemicals = max(1, sum(1 for name in self.names if name.strip()))
 
-    def download_and_track_progress(self, url, save_folder, file_type, log_file, cid_file):
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=MAX_RETRIES,
-            backoff_factor=RETRY_DELAY,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "OPTIONS"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
-
-        response = session.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            if 'IdentifierList' in data:
-                cid = data['IdentifierList']['CID'][0]
-                cid_file.write(f"{cid}\n")  # Write CID to cid_list.txt
-                file_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/CID/{cid}/record/{file_type}/?record_type=3d"
-                return self.download_file(file_url, save_folder, f"{cid}.{file_type}", log_file)
-        else:
-            error_msg = f"Failed to download {file_type} file for {url}: {response.status_code} - {response.reason}"
-            self.log_error(error_msg, log_file)
-        return False
-
-    def download_file(self, url, save_folder, filename, log_file):
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=MAX_RETRIES,
-            backoff_factor=RETRY_DELAY,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "OPTIONS"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
-
-        response = session.get(url, stream=True)
-        if response.status_code == 200:
-            with open(os.path.join(save_folder, filename), 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-            return True
-        else:
-            error_msg = f"Failed to download {filename}: {response.status_code} - {response.reason}"
-            self.log_error(error_msg, log_file)
-            response.raise_for_status()  # Raise an exception for non-200 responses
+        last_percent = [-1]
+
+        def on_progress(done, downloaded_count, error_count):
+            percent = int(done / total_chemicals * 100)
+            if percent != last_percent[0]:  # one signal per percent, not per compound
+                last_percent[0] = percent
+                self.update_progress(percent)
 
-    def log_error(self, error_msg, log_file):
-        with open(log_file, 'a') as f:
-            f.write(error_msg + '\n')
+        downloaded_count, error_count = pubchem.download(self.names, self.save_folder, self.file_type, self.is_retry, on_progress)
+        self.finished.emit(downloaded_count, error_count)
 
 class MyApp(QWidget):
     def __init__(self):
@@ -309,7 +228,7 @@ class MyApp(QWidget):
         if log_file[0]:
             with open(log_file[0], 'r') as f:
                 lines = f.readlines()
-            failed_chemicals = [line.split(' ')[3].split('.')[0] for line in lines if '503' in line]
+            failed_chemicals = pubchem.retryable_cids(lines)
             self.textEdit.setText('\n'.join(failed_chemicals))
             self.startDownload()
 
@@ -0,0 +1,108 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+LEDGER_FILE = "docking_ledger.jsonl"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def file_digest(path):
+    """SHA-256 of a file's contents, or None if it does not exist."""
+    sha = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    except FileNotFoundError:
+        return None
+    return sha.hexdigest()
+
+class JobLedger:
+    """Durable record of every ligand's docking state.
+
+    The ledger is an append-only JSON-lines file; each line records one state
+    change together with the hashes of the ligand, receptor and conf.txt it was
+    docked with. Replaying the file gives the latest state per ligand, so a run
+    that dies part way can skip everything already done with the same inputs.
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+        self.compact()
+        self.handle = open(self.path, 'a')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                self.entries[record["ligand"]] = record
+
+    def compact(self):
+        """Rewrite the ledger with only the latest record per ligand."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def state(self, ligand):
+        record = self.entries.get(ligand)
+        return record["state"] if record else PENDING
+
+    def needs_docking(self, ligand, inputs):
+        """True unless the ligand finished successfully with exactly these inputs."""
+        record = self.entries.get(ligand)
+        return not (record and record["state"] == DONE and record["inputs"] == inputs)
+
+    def mark(self, ligand, state, inputs):
+        self.mark_many([ligand], state, {ligand: inputs})
+
+    def mark_many(self, ligands, state, inputs):
+        """Record the same state for many ligands with a single fsync."""
+        with self.lock:
+            for ligand in ligands:
+                record = {"ligand": ligand, "state": state, "inputs": inputs[ligand]}
+                self.entries[ligand] = record
+                self.handle.write(json.dumps(record) + '\n')
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    def counts(self):
+        totals = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for record in self.entries.values():
+            totals[record["state"]] += 1
+        return totals
+
+    def close(self):
+        self.handle.close()
@@ -0,0 +1,270 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Live leaderboard of a docking run in progress.
+
+Results are picked up from whichever the run produces: master_log.log is
+tailed from the last byte read, logs.archive is followed through its index,
+and otherwise the directory is scanned for log files not seen before. Nothing
+already processed is read again. The best top_k ligands are kept in a heap and
+written to leaderboard.txt with the docking rate and an ETA. Docked and failed
+ligands are counted from the job ledger (or else distinct CIDs with results and
+stale logs without them), so watching ends once every ligand has either docked
+or failed.
+
+    python3 Programs/leaderboard.py /path/to/docking/directory
+"""
+
+import os
+import sys
+import time
+import heapq
+import json
+import sqlite3
+import vinalog
+import vina_engine
+import log_archive
+from job_ledger import LEDGER_FILE, PENDING, RUNNING, DONE, FAILED
+
+LEADERBOARD_FILE = "leaderboard.txt"
+TOP_K = 50
+REFRESH_SECONDS = 10
+STALE_SECONDS = 60  # a log without a mode table this old is a failed run, not one being written
+
+class MasterLogSource:
+    """New results from master_log.log, reading only the bytes appended since the last poll."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.parser = vinalog.MasterLogParser()
+        self.failed = 0
+
+    def poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:  # a new run rewrote the file
+            self.offset, self.parser = 0, vinalog.MasterLogParser()
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        complete = data.rfind(b'\n') + 1  # leave a half-written last line for the next poll
+        self.offset += complete
+        results = []
+        for line in data[:complete].decode(errors='replace').splitlines(True):
+            result = self.parser.feed(line)
+            if result is not None:
+                results.append((vinalog.cid_from_log(result[0]), result[1]))
+        return results
+
+class ArchiveSource:
+    """New results from logs.archive, following its index by insertion order."""
+
+    def __init__(self, path):
+        self.path = path
+        self.last_row = 0
+        self.failed = 0
+        self.db = sqlite3.connect(f"file:{path}.index?mode=ro", uri=True, timeout=60)
+        self.data = open(path, 'rb')
+
+    def poll(self):
+        results = []
+        rows = self.db.execute("SELECT rowid, ligand, offset, length FROM logs WHERE rowid > ? ORDER BY rowid", (self.last_row,)).fetchall()
+        for rowid, ligand, offset, length in rows:
+            self.data.seek(offset)
+            table = vinalog.parse_mode_table(log_archive.decompress(self.data.read(length)).splitlines(True), first_only=True)
+            if table:
+                results.append((vinalog.cid_from_log(ligand), table[0][1]))
+            self.last_row = rowid
+        return results
+
+class DirectorySource:
+    """New results from per-ligand log files that have not been seen before."""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.seen = set()
+        self.failed = 0
+
+    def poll(self):
+        results = []
+        now = time.time()
+        with os.scandir(self.log_dir) as entries:
+            for entry in entries:
+                if entry.name in self.seen or not entry.name.endswith(vinalog.LOG_SUFFIX):
+                    continue
+                try:
+                    result = vinalog.best_affinity(entry.path)
+                    stale = now - entry.stat().st_mtime > STALE_SECONDS
+                except OSError:
+                    continue
+                if result is not None or stale:
+                    self.seen.add(entry.name)
+                if result is not None:
+                    results.append(result)
+                elif stale:
+                    self.failed += 1
+        return results
+
+class LedgerTail:
+    """Latest state per ligand from the job ledger of a run, read incrementally without locking it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+        self.states = {}
+
+    def poll(self):
+        """{state: ligand count} after reading the records appended since the last poll."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        if stat.st_ino != self.inode or stat.st_size < self.offset:  # compacted into a new file
+            self.inode, self.offset, self.states = stat.st_ino, 0, {}
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(stat.st_size - self.offset)
+        complete = data.rfind(b'\n') + 1
+        self.offset += complete
+        for line in data[:complete].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self.states[record["ligand"]] = record["state"]
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for state in self.states.values():
+            counts[state] += 1
+        return counts
+
+def open_source(log_dir):
+    """Follow the richest result stream the run in log_dir is producing."""
+    master_log = os.path.join(log_dir, vina_engine.MASTER_LOG)
+    archive = os.path.join(log_dir, log_archive.ARCHIVE_FILE)
+    if os.path.exists(archive + ".index"):
+        return ArchiveSource(archive)
+    if os.path.exists(master_log):
+        return MasterLogSource(master_log)
+    return DirectorySource(log_dir)
+
+class Leaderboard:
+    """The top_k best affinities seen so far, kept in a bounded heap."""
+
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self.heap = []  # (-affinity, cid): the worst kept result is at heap[0]
+        self.members = {}
+        self.seen = set()  # every CID with a result, so re-docks and old master log entries count once
+
+    @property
+    def docked(self):
+        return len(self.seen)
+
+    def add(self, cid, affinity):
+        self.seen.add(cid)
+        if cid in self.members:
+            if affinity >= self.members[cid]:
+                return
+            self.heap.remove((-self.members[cid], cid))  # a better re-dock of a ligand on the board
+            heapq.heapify(self.heap)
+            del self.members[cid]
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, (-affinity, cid))
+        elif -affinity > self.heap[0][0]:
+            _, dropped = heapq.heapreplace(self.heap, (-affinity, cid))
+            del self.members[dropped]
+        else:
+            return
+        self.members[cid] = affinity
+
+    def ranked(self):
+        return sorted(self.members.items(), key=lambda item: item[1])
+
+def render(board, rate, total, started, docked, failed=0):
+    """Leaderboard text with progress, rate and ETA."""
+    lines = [f"Updated {time.strftime('%Y-%m-%d %H:%M:%S')}, watching since {time.strftime('%H:%M:%S', time.localtime(started))}"]
+    progress = f"Docked: {docked}" + (f" / {total}" if total else "")
+    if failed:
+        progress += f"   Failed: {failed}"
+    progress += f"   Rate: {rate * 3600:.0f} ligands/hour"
+    if total and rate > 0:
+        remaining = max(0, total - docked - failed) / rate
+        progress += f"   ETA: {time.strftime('%Y-%m-%d %H:%M', time.localtime(time.time() + remaining))}"
+        progress += f" ({remaining / 3600:.1f} h left)"
+    lines.append(progress)
+    lines.append("")
+    col_widths = [6, 30, 20]
+    lines.append(' | '.join(str(item).ljust(width) for item, width in zip(["Rank", "CID", "Affinity (kcal/mol)"], col_widths)))
+    lines.append('=' * 62)
+    for rank, (cid, affinity) in enumerate(board.ranked(), 1):
+        lines.append(' | '.join(str(item).ljust(width) for item, width in zip((rank, cid, affinity), col_widths)))
+    return '\n'.join(lines) + '\n'
+
+def count_ligands(log_dir):
+    ligand_list = os.path.join(log_dir, vina_engine.LIGAND_LIST)
+    if not os.path.exists(ligand_list):
+        return None
+    return len(vina_engine.read_ligand_list(ligand_list))
+
+def watch(log_dir, top_k=TOP_K, interval=REFRESH_SECONDS, total=None, output_file=None, show=True):
+    """Refresh the leaderboard every interval seconds until all ligands are docked or failed, or Ctrl+C."""
+    source = open_source(log_dir)
+    ledger = LedgerTail(os.path.join(log_dir, LEDGER_FILE))
+    board = Leaderboard(top_k)
+    total = total or count_ligands(log_dir)
+    output_file = output_file or os.path.join(log_dir, LEADERBOARD_FILE)
+    started = time.time()
+    print(f"Watching {log_dir} via {type(source).__name__}, press Ctrl+C to stop")
+    baseline = None
+    try:
+        while True:
+            for cid, affinity in source.poll():
+                board.add(cid, affinity)
+            states = ledger.poll()
+            if states is not None:  # the ledger knows each ligand's latest state, the logs may hold old runs
+                docked, failed = states[DONE], states[FAILED]
+            else:
+                docked, failed = board.docked, source.failed
+            if baseline is None:
+                baseline = docked  # results that were already there do not count towards the rate
+            elapsed = time.time() - started
+            rate = (docked - baseline) / elapsed if elapsed > 0 else 0
+            text = render(board, rate, total, started, docked, failed)
+            vina_engine.write_atomic(output_file, text)
+            if show:
+                print("\033[2J\033[H" + text, end='', flush=True)
+            if total and docked + failed >= total:
+                print("All ligands docked." if not failed else f"All ligands processed, {failed} failed.")
+                break
+            if states is not None and not states[PENDING] and not states[RUNNING] and states[DONE] + states[FAILED] >= (total or 1):
+                print("The job ledger has no ligands left to dock.")
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    return board.ranked()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 Programs/leaderboard.py <docking directory> [top_k]")
+        sys.exit(1)
+    watch(sys.argv[1], top_k=int(sys.argv[2]) if len(sys.argv) > 2 else TOP_K)
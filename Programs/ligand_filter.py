@@ -0,0 +1,438 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import math
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from workers import default_jobs, imap_ordered
+from ligand_prep import iter_sdf_records
+
+REJECTION_LOG = "prefilter_rejections.log"
+REJECTED_DIR = "Rejected"
+CHUNK_SIZE = 500  # records per task sent to a filter process
+STEREO_EPSILON = 0.1  # geometry flatter than this leaves a centre or double bond unspecified
+
+DEFAULT_CRITERIA = {
+    "min_heavy_atoms": 5,
+    "max_heavy_atoms": 70,
+    "max_rotatable_bonds": 10,
+    "max_fragments": 1,
+    "elements": {"C", "H", "N", "O", "S", "P", "F", "Cl", "Br", "I"},
+}
+
+def parse_connection_table(record):
+    """Read atoms, bonds and coordinates from a V2000 or V3000 molfile record.
+
+    Returns (elements, charges, bonds, coords) where bonds are (atom a, atom b,
+    order) with zero-based atom indices and coords are [x, y, z] per atom, or
+    raises ValueError for unreadable records. In a flat (2D) record, the far
+    atom of each wedge or hash bond is lifted above or below the plane, so
+    chirality can be read from the coordinates as for a 3D record.
+    """
+    lines = record.split('\n')
+    if len(lines) < 4:
+        raise ValueError("truncated header")
+    counts = lines[3]
+    elements, charges, bonds, coords, wedges = [], [], [], [], []
+    if "V3000" in counts:
+        section = None
+        for line in lines[4:]:
+            if not line.startswith("M  V30 "):
+                continue
+            fields = line[7:].split()
+            if fields[:2] == ["BEGIN", "ATOM"] or fields[:2] == ["BEGIN", "BOND"]:
+                section = fields[1]
+            elif fields[:1] == ["END"]:
+                section = None
+            elif section == "ATOM":
+                elements.append(fields[1])
+                coords.append([float(value) for value in fields[2:5]])
+                charge = [f for f in fields[6:] if f.startswith("CHG=")]
+                charges.append(int(charge[0][4:]) if charge else 0)
+            elif section == "BOND":
+                bonds.append((int(fields[2]) - 1, int(fields[3]) - 1, int(fields[1])))
+                config = [f for f in fields[4:] if f.startswith("CFG=")]
+                if config and config[0][4:] in ("1", "3"):  # 1 = wedge, 3 = hash
+                    wedges.append((bonds[-1][0], bonds[-1][1], 1.0 if config[0][4:] == "1" else -1.0))
+        check_bonds(len(elements), bonds)
+        lift_wedges(coords, wedges)
+        return elements, charges, bonds, coords
+
+    n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+    if len(lines) < 4 + n_atoms + n_bonds:
+        raise ValueError("truncated connection table")
+    # Old-style atom block charge codes: 1=+3, 2=+2, 3=+1, 5=-1, 6=-2, 7=-3
+    charge_codes = {1: 3, 2: 2, 3: 1, 5: -1, 6: -2, 7: -3}
+    for line in lines[4:4 + n_atoms]:
+        coords.append([float(line[0:10]), float(line[10:20]), float(line[20:30])])
+        elements.append(line[31:34].strip())
+        code = line[36:39].strip()
+        charges.append(charge_codes.get(int(code), 0) if code.isdigit() else 0)
+    for line in lines[4 + n_atoms:4 + n_atoms + n_bonds]:
+        bonds.append((int(line[0:3]) - 1, int(line[3:6]) - 1, int(line[6:9])))
+        stereo = line[9:12].strip()
+        if stereo in ("1", "6"):  # 1 = wedge, 6 = hash
+            wedges.append((bonds[-1][0], bonds[-1][1], 1.0 if stereo == "1" else -1.0))
+    for line in lines[4 + n_atoms + n_bonds:]:
+        if line.startswith("M  CHG"):
+            fields = line.split()[3:]
+            for atom, charge in zip(fields[0::2], fields[1::2]):
+                if not 1 <= int(atom) <= n_atoms:
+                    raise ValueError(f"charge on atom {atom} of {n_atoms}")
+                charges[int(atom) - 1] = int(charge)
+    check_bonds(n_atoms, bonds)
+    lift_wedges(coords, wedges)
+    return elements, charges, bonds, coords
+
+def lift_wedges(coords, wedges):
+    """Move the far atom of each (stereocentre, atom, +1 wedge / -1 hash) bond off a flat drawing."""
+    if not wedges or any(abs(z) > 1e-4 for _, _, z in coords):
+        return
+    for _, atom, direction in wedges:
+        coords[atom][2] = direction
+
+def check_bonds(n_atoms, bonds):
+    """Raise ValueError for a bond to an atom that is not in the atom block."""
+    for a, b, _ in bonds:
+        if not (0 <= a < n_atoms and 0 <= b < n_atoms) or a == b:
+            raise ValueError(f"bond {a + 1}-{b + 1} outside {n_atoms} atoms")
+
+def count_fragments(n_atoms, bonds):
+    """Number of disconnected pieces (e.g. salts and solvents) in the molecule."""
+    parent = list(range(n_atoms))
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+    for a, b, _ in bonds:
+        parent[find(a)] = find(b)
+    return len({find(a) for a in range(n_atoms)})
+
+def ring_bonds(n_atoms, bonds):
+    """Indices of bonds that lie in a ring, i.e. every bond that is not a bridge."""
+    neighbours = [[] for _ in range(n_atoms)]
+    for index, (a, b, _) in enumerate(bonds):
+        neighbours[a].append((b, index))
+        neighbours[b].append((a, index))
+    order = [-1] * n_atoms
+    low = [0] * n_atoms
+    bridges = set()
+    counter = 0
+    for root in range(n_atoms):
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack = [(root, -1, iter(neighbours[root]))]
+        while stack:
+            atom, via, edges = stack[-1]
+            advanced = False
+            for other, index in edges:
+                if index == via:
+                    continue
+                if order[other] == -1:
+                    order[other] = low[other] = counter
+                    counter += 1
+                    stack.append((other, index, iter(neighbours[other])))
+                    advanced = True
+                    break
+                low[atom] = min(low[atom], order[other])
+            if not advanced:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    low[parent] = min(low[parent], low[atom])
+                    if low[atom] > order[parent]:
+                        bridges.add(via)
+    return set(range(len(bonds))) - bridges
+
+def rotatable_bonds(elements, bonds):
+    """Single, non-ring bonds between two non-terminal heavy atoms."""
+    heavy_degree = [0] * len(elements)
+    for a, b, _ in bonds:
+        if elements[a] != 'H' and elements[b] != 'H':
+            heavy_degree[a] += 1
+            heavy_degree[b] += 1
+    in_ring = ring_bonds(len(elements), bonds)
+    return sum(1 for index, (a, b, order) in enumerate(bonds)
+               if order == 1 and index not in in_ring
+               and elements[a] != 'H' and elements[b] != 'H'
+               and heavy_degree[a] > 1 and heavy_degree[b] > 1)
+
+def refine_labels(labels, neighbours):
+    """Refine atom labels with their neighbours' labels and bond orders until the partition stops changing."""
+    classes = len(set(labels.values()))
+    for _ in range(len(labels)):
+        labels = {i: hashlib.sha1((labels[i] + '|' + ','.join(sorted(f"{order}{labels[j]}" for j, order in neighbours[i]))).encode()).hexdigest()
+                  for i in labels}
+        new_classes = len(set(labels.values()))
+        if new_classes == classes:
+            break
+        classes = new_classes
+    return labels
+
+def unit(vector):
+    length = math.sqrt(sum(value * value for value in vector))
+    return [value / length for value in vector] if length > 0 else [0.0, 0.0, 0.0]
+
+def minus(p, q):
+    return [p[0] - q[0], p[1] - q[1], p[2] - q[2]]
+
+def chirality(atom, elements, charges, hydrogens, neighbours, labels, coords):
+    """'@' or '@@' for a tetrahedral stereocentre with specified geometry, else ''.
+
+    Neighbours are ranked by refined label (the lowest, or the implicit
+    hydrogen, points away) and the tag is the handedness of the top three.
+    """
+    heavy = neighbours[atom]
+    if any(order != 1 for _, order in heavy):
+        return ''
+    substituents = len(heavy) + hydrogens[atom]
+    if len(heavy) == 3 and hydrogens[atom] == 0 and elements[atom] == 'C' and charges[atom] == 0:
+        substituents = 4  # implicit hydrogen
+    if substituents != 4 or len(heavy) < 3 or len({labels[j] for j, _ in heavy}) < len(heavy):
+        return ''
+    ranked = sorted((j for j, _ in heavy), key=lambda j: labels[j], reverse=True)[:3]
+    v1, v2, v3 = (unit(minus(coords[j], coords[atom])) for j in ranked)
+    volume = (v1[0] * (v2[1] * v3[2] - v2[2] * v3[1]) - v1[1] * (v2[0] * v3[2] - v2[2] * v3[0])
+              + v1[2] * (v2[0] * v3[1] - v2[1] * v3[0]))
+    if abs(volume) < STEREO_EPSILON:
+        return ''
+    return '@' if volume > 0 else '@@'
+
+def double_bond_geometry(a, b, neighbours, labels, coords):
+    """'Z' or 'E' for a double bond a=b whose top-ranked substituents have specified geometry, else ''."""
+    ends = []
+    for atom, other in ((a, b), (b, a)):
+        substituents = [j for j, _ in neighbours[atom] if j != other]
+        if not substituents or (len(substituents) == 2 and labels[substituents[0]] == labels[substituents[1]]):
+            return ''
+        ends.append(max(substituents, key=lambda j: labels[j]))
+    axis = unit(minus(coords[b], coords[a]))
+    def across(start, substituent):
+        v = minus(coords[substituent], coords[start])
+        along = sum(x * y for x, y in zip(v, axis))
+        return unit([x - along * y for x, y in zip(v, axis)])
+    side = sum(x * y for x, y in zip(across(a, ends[0]), across(b, ends[1])))
+    if abs(side) < STEREO_EPSILON:
+        return ''
+    return 'Z' if side > 0 else 'E'
+
+def canonical_hash(elements, charges, bonds, coords=None):
+    """Hash of the connection table that does not depend on atom order, and the heavy-atom graph.
+
+    Atom labels (element, charge, attached hydrogens) are refined with their
+    neighbours' labels and bond orders until the partition stops changing, so
+    the same molecule written with atoms in a different order hashes the same.
+    With coords, tetrahedral centres and non-ring double bonds whose geometry
+    is specified get chirality and E/Z tags and the labels are refined again,
+    so stereoisomers hash (and match) differently. Some different molecules
+    (e.g. decalin and bicyclopentyl) hash the same, so the hash only picks
+    candidates that same_molecule then compares. The graph is (atom labels,
+    bonds) over heavy atoms renumbered from zero; bond orders of double bonds
+    with E/Z geometry are '2E' or '2Z'.
+    """
+    heavy = [i for i, element in enumerate(elements) if element != 'H']
+    hydrogens = [0] * len(elements)
+    neighbours = {i: [] for i in heavy}
+    for a, b, order in bonds:
+        if elements[a] == 'H' or elements[b] == 'H':
+            hydrogens[b if elements[a] == 'H' else a] += 1
+        else:
+            neighbours[a].append((b, order))
+            neighbours[b].append((a, order))
+    labels = refine_labels({i: f"{elements[i]}{charges[i]:+d}H{hydrogens[i]}" for i in heavy}, neighbours)
+    if coords is not None:
+        in_ring = ring_bonds(len(elements), bonds)
+        geometry = {}
+        for index, (a, b, order) in enumerate(bonds):
+            if order == 2 and index not in in_ring and a in labels and b in labels:
+                tag = double_bond_geometry(a, b, neighbours, labels, coords)
+                if tag:
+                    geometry[frozenset((a, b))] = f"2{tag}"
+        tags = {i: chirality(i, elements, charges, hydrogens, neighbours, labels, coords) for i in heavy}
+        if geometry or any(tags.values()):
+            bonds = [(a, b, geometry.get(frozenset((a, b)), order)) for a, b, order in bonds]
+            neighbours = {i: [(j, geometry.get(frozenset((i, j)), order)) for j, order in neighbours[i]] for i in heavy}
+            labels = refine_labels({i: labels[i] + tags[i] for i in heavy}, neighbours)
+    edges = sorted('-'.join(sorted((labels[a], labels[b]))) + str(order)
+                   for a, b, order in bonds if a in labels and b in labels)
+    digest = hashlib.sha1(('/'.join(sorted(labels.values())) + '#' + '/'.join(edges)).encode()).digest()
+    number = {atom: index for index, atom in enumerate(heavy)}
+    graph = (tuple(int(labels[atom][:12], 16) for atom in heavy),
+             tuple((number[a], number[b], order) for a, b, order in bonds if a in number and b in number))
+    return digest, graph
+
+def same_molecule(graph_a, graph_b):
+    """Whether two heavy-atom graphs from canonical_hash are isomorphic."""
+    return match_atoms(graph_a, graph_b) is not None
+
+def match_atoms(graph_a, graph_b, prefer=None):
+    """An isomorphism {atom of a: atom of b} between two graphs from canonical_hash, or None.
+
+    Backtracking search mapping atoms of a onto atoms of b with the same
+    refined label, keeping every bond (and its order) between mapped atoms.
+    prefer(atom of a, candidate atoms of b) may reorder the candidates tried,
+    e.g. nearest first, to pick among the mappings of a symmetric graph.
+    """
+    labels_a, bonds_a = graph_a
+    labels_b, bonds_b = graph_b
+    if len(labels_a) != len(labels_b) or len(bonds_a) != len(bonds_b) or sorted(labels_a) != sorted(labels_b):
+        return None
+    def adjacency(n_atoms, bonds):
+        neighbours = [{} for _ in range(n_atoms)]
+        for a, b, order in bonds:
+            neighbours[a][b] = neighbours[b][a] = order
+        return neighbours
+    near_a, near_b = adjacency(len(labels_a), bonds_a), adjacency(len(labels_b), bonds_b)
+    # visit atoms of a breadth first so each new atom is bonded to one already mapped
+    sequence, visited = [], set()
+    for root in sorted(range(len(labels_a)), key=lambda atom: labels_a.count(labels_a[atom])):
+        if root in visited:
+            continue
+        visited.add(root)
+        queue = [root]
+        while queue:
+            atom = queue.pop(0)
+            sequence.append(atom)
+            for other in near_a[atom]:
+                if other not in visited:
+                    visited.add(other)
+                    queue.append(other)
+    mapping, used = {}, set()
+
+    def extend(position):
+        if position == len(sequence):
+            return True
+        atom = sequence[position]
+        mapped = [(other, order) for other, order in near_a[atom].items() if other in mapping]
+        candidates = near_b[mapping[mapped[0][0]]] if mapped else range(len(labels_b))
+        if prefer is not None:
+            candidates = prefer(atom, list(candidates))
+        for candidate in candidates:
+            if candidate in used or labels_b[candidate] != labels_a[atom]:
+                continue
+            if any(near_b[candidate].get(mapping[other]) != order for other, order in mapped):
+                continue
+            if sum(1 for other in near_b[candidate] if other in used) != len(mapped):
+                continue  # candidate is bonded to a mapped atom that atom is not bonded to
+            mapping[atom] = candidate
+            used.add(candidate)
+            if extend(position + 1):
+                return True
+            del mapping[atom]
+            used.discard(candidate)
+        return False
+    return mapping if extend(0) else None
+
+def evaluate_record(record, criteria=DEFAULT_CRITERIA):
+    """Return (rejection reason or None, canonical hash or None, graph or None) for one SDF record."""
+    try:
+        elements, charges, bonds, coords = parse_connection_table(record)
+    except (ValueError, IndexError) as e:
+        return f"unreadable connection table ({e})", None, None
+    heavy_atoms = sum(1 for element in elements if element != 'H')
+    if heavy_atoms < criteria["min_heavy_atoms"]:
+        return f"{heavy_atoms} heavy atoms (minimum {criteria['min_heavy_atoms']})", None, None
+    if heavy_atoms > criteria["max_heavy_atoms"]:
+        return f"{heavy_atoms} heavy atoms (maximum {criteria['max_heavy_atoms']})", None, None
+    foreign = sorted(set(elements) - criteria["elements"])
+    if foreign:
+        return f"elements outside whitelist: {' '.join(foreign)}", None, None
+    fragments = count_fragments(len(elements), bonds)
+    if fragments > criteria["max_fragments"]:
+        return f"{fragments} disconnected fragments", None, None
+    rotatable = rotatable_bonds(elements, bonds)
+    if rotatable > criteria["max_rotatable_bonds"]:
+        return f"{rotatable} rotatable bonds (maximum {criteria['max_rotatable_bonds']})", None, None
+    return (None,) + canonical_hash(elements, charges, bonds, coords)
+
+def evaluate_chunk(chunk, criteria=DEFAULT_CRITERIA):
+    return [evaluate_record(record, criteria) for _, _, record in chunk]
+
+def iter_chunks(sdf_paths, chunk_size=CHUNK_SIZE):
+    """(path, record number, record) tuples from every file, grouped into chunks."""
+    chunk = []
+    for path in sdf_paths:
+        for number, record in enumerate(iter_sdf_records(path), 1):
+            chunk.append((path, number, record))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def prefilter_sdf_files(sdf_paths, jobs=None, rejection_log=REJECTION_LOG, rejected_dir=REJECTED_DIR):
+    """Drop oversized, flexible, exotic, disconnected and duplicate records before minimization.
+
+    Records are parsed and scored in parallel processes; duplicates are found
+    by canonical hash and confirmed by graph isomorphism in this process. Files whose records all pass are left
+    untouched, files with no surviving record are moved to rejected_dir, and
+    multi-record files are rewritten in place with only their passing records.
+    Every rejection is written to rejection_log with its reason.
+    Returns (accepted, rejected) record counts.
+    """
+    jobs = jobs or default_jobs()
+    seen = {}
+    accepted = rejected = 0
+    current = {"path": None}
+
+    def finish_file():
+        path = current["path"]
+        if path is None:
+            return
+        current["out"].close()
+        if current["kept"] == 0:
+            os.remove(current["tmp"])
+            os.makedirs(rejected_dir, exist_ok=True)
+            shutil.move(path, os.path.join(rejected_dir, os.path.basename(path)))
+        elif current["dropped"] == 0:
+            os.remove(current["tmp"])
+        else:
+            os.replace(current["tmp"], path)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor, open(rejection_log, 'a') as log, \
+            tqdm(desc="Prefiltering ligands", unit=" records") as progress:
+        for chunk, future in imap_ordered(executor, evaluate_chunk, iter_chunks(sdf_paths), jobs * 2):
+            for (path, number, record), (reason, digest, graph) in zip(chunk, future.result()):
+                if path != current["path"]:
+                    finish_file()
+                    tmp = path + ".filter.tmp"
+                    current.update(path=path, tmp=tmp, out=open(tmp, 'w'), kept=0, dropped=0)
+                if reason is None:
+                    for first, first_graph in seen.get(digest, ()):
+                        if same_molecule(graph, first_graph):
+                            reason = f"duplicate of {first}"
+                            break
+                if reason is None:
+                    seen.setdefault(digest, []).append((f"{path}#{number}", graph))
+                    current["out"].write(record + "$$$$\n")
+                    current["kept"] += 1
+                    accepted += 1
+                else:
+                    title = record.split('\n', 1)[0].strip()
+                    log.write(f"{path}#{number} {title}: {reason}\n")
+                    current["dropped"] += 1
+                    rejected += 1
+            progress.update(len(chunk))
+        finish_file()
+    print(f"Prefilter kept {accepted} records and rejected {rejected}, see {rejection_log} for the reasons.")
+    return accepted, rejected
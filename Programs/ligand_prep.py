@@ -0,0 +1,225 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from workers import default_jobs, imap_bounded
+
+OBMINIMIZE = "obminimize"
+OBABEL = "obabel"
+MINIMIZE_TIMEOUT = 600  # seconds allowed per ligand before obminimize is killed
+MINIMIZE_ERRORS = "minimization_errors.log"
+MINIMIZED_DIR = "Minimized"
+CONVERSION_ERRORS = "conversion_errors.log"
+LIGAND_MANIFEST = "ligands.txt"
+SHARD_DIR = "PDBQT_Shards"
+SHARD_SIZE = 5000  # ligands per shard folder
+CHUNK_SIZE = 200  # records handed to one obabel process
+
+def minimized_path(sdf_file, out_dir=MINIMIZED_DIR):
+    """Where the minimized copy of sdf_file goes: out_dir next to it, under the same name."""
+    return os.path.join(os.path.dirname(sdf_file), out_dir, os.path.basename(sdf_file))
+
+def minimized_files(sdf_files, out_dir=MINIMIZED_DIR):
+    """Each file's minimized copy, or the file itself if it has none newer than the original."""
+    selected = []
+    for sdf_file in sdf_files:
+        minimized = minimized_path(sdf_file, out_dir)
+        fresh = os.path.exists(minimized) and os.path.getmtime(minimized) >= os.path.getmtime(sdf_file)
+        selected.append(minimized if fresh else sdf_file)
+    return selected
+
+def minimize_ligand(sdf_file, forcefield="MMFF94", steps=1000, timeout=MINIMIZE_TIMEOUT, output_file=None):
+    """Energy minimize one ligand into output_file (minimized_path(sdf_file) by default).
+
+    The input is left untouched. obminimize prints the minimized structure on
+    stdout; it is written to a temporary file and moved into place with
+    os.replace, so output_file only ever holds a complete structure. Returns
+    None on success or an error message.
+    """
+    output_file = output_file or minimized_path(sdf_file)
+    command = [OBMINIMIZE, "-ff", forcefield, "-n", str(steps), "-o", "sdf", sdf_file]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return f"timed out after {timeout} s"
+    except OSError as e:
+        return f"failed to run {OBMINIMIZE}: {e}"
+    if result.returncode != 0 or "$$$$" not in result.stdout:
+        return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    tmp_path = f"{output_file}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(result.stdout)
+    os.replace(tmp_path, output_file)
+    return None
+
+def minimize_ligands(sdf_files, jobs=None, timeout=MINIMIZE_TIMEOUT, error_log=MINIMIZE_ERRORS):
+    """Minimize every file with one obminimize process per ligand across a worker pool.
+
+    The minimized structures go to MINIMIZED_DIR next to the inputs. Ligands
+    that fail or exceed the per-ligand timeout get no minimized copy and are
+    listed in error_log. Returns the list of failed files.
+    """
+    jobs = jobs or default_jobs()
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor, open(error_log, 'a') as errors:
+        minimize = functools.partial(minimize_ligand, timeout=timeout)
+        for sdf_file, future in tqdm(imap_bounded(executor, minimize, sdf_files, jobs * 2), total=len(sdf_files), desc="Minimizing ligands"):
+            error = future.result()
+            if error:
+                failed.append(sdf_file)
+                errors.write(f"{sdf_file}: {error}\n")
+    if failed:
+        print(f"Minimization failed for {len(failed)} ligands, see {error_log} for details.")
+    return failed
+
+def iter_sdf_records(path):
+    """Lazily yield each record of an SDF file (without its $$$$ line), however large the file."""
+    record = []
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            if line.startswith("$$$$"):
+                yield ''.join(record)
+                record = []
+            else:
+                record.append(line)
+    if ''.join(record).strip():
+        yield ''.join(record)
+
+def safe_name(title):
+    """Turn an SDF title into something usable as a file name."""
+    return ''.join(c if c.isalnum() or c in "-_." else '_' for c in title.strip()).strip('.')
+
+def iter_named_chunks(sdf_paths, out_dir=SHARD_DIR, chunk_size=CHUNK_SIZE, shard_size=SHARD_SIZE):
+    """Group SDF records into (shard folder, [(ligand name, record)]) conversion chunks.
+
+    Records are spread over shard folders of at most shard_size ligands. Each
+    record is named after its title, falling back to its running number when the
+    title is empty or already used in the same shard.
+    """
+    index = 0
+    chunk, names, shard = [], set(), None
+    for sdf_path in sdf_paths:
+        for record in iter_sdf_records(sdf_path):
+            record_shard = os.path.join(out_dir, f"shard_{index // shard_size:05d}")
+            if record_shard != shard:
+                if chunk:
+                    yield shard, chunk
+                chunk, names, shard = [], set(), record_shard
+            elif len(chunk) >= chunk_size:
+                yield shard, chunk
+                chunk = []
+            title, _, body = record.partition('\n')
+            name = safe_name(title)
+            if not name or name in names:
+                name = f"{name or 'ligand'}_{index}"
+            names.add(name)
+            chunk.append((name, f"{name}\n{body}"))
+            index += 1
+    if chunk:
+        yield shard, chunk
+
+def split_pdbqt_molecules(lines):
+    """Split multi-molecule obabel PDBQT output into {ligand name: lines}.
+
+    Molecules start at a MODEL record or at their REMARK Name line; MODEL and
+    ENDMDL records are dropped because Vina does not accept them in ligands.
+    """
+    molecules = {}
+    current = None
+    for line in lines:
+        if line.startswith("MODEL"):
+            current = None
+        elif line.startswith("ENDMDL"):
+            continue
+        elif line.startswith("REMARK") and line[6:].strip().startswith("Name ="):
+            current = line.split('=', 1)[1].strip()
+            molecules[current] = [line]
+        elif current is not None:
+            molecules[current].append(line)
+    return molecules
+
+def convert_chunk(shard_chunk):
+    """Convert one chunk of SDF records with a single obabel call.
+
+    Returns (written PDBQT paths, names of records obabel could not convert).
+    """
+    shard, chunk = shard_chunk
+    os.makedirs(shard, exist_ok=True)
+    chunk_file = os.path.join(shard, f".chunk_{chunk[0][0]}.sdf")
+    with open(chunk_file, 'w') as f:
+        for _, record in chunk:
+            f.write(record)
+            f.write("$$$$\n")
+    try:
+        result = subprocess.run([OBABEL, "-isdf", chunk_file, "-opdbqt"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        molecules = split_pdbqt_molecules(result.stdout.splitlines(keepends=True))
+    except OSError:
+        molecules = {}
+    finally:
+        os.remove(chunk_file)
+    written, failed = [], []
+    for name, _ in chunk:
+        if name not in molecules:
+            failed.append(name)
+            continue
+        path = os.path.join(shard, f"{name}.pdbqt")
+        with open(path, 'w') as f:
+            f.writelines(molecules[name])
+        written.append(path)
+    return written, failed
+
+def convert_sdf_library(sdf_paths, out_dir=SHARD_DIR, manifest=LIGAND_MANIFEST, jobs=None,
+                        chunk_size=CHUNK_SIZE, shard_size=SHARD_SIZE, error_log=CONVERSION_ERRORS):
+    """Stream SDF files (single or multi-record, any size) into sharded PDBQT ligands.
+
+    Records are read lazily and converted chunk by chunk across a pool of
+    obabel processes, with only a bounded number of chunks in memory. Every
+    converted ligand is appended to the manifest as soon as its chunk finishes,
+    so ligands.txt is built without globbing. Returns the number of ligands written.
+    """
+    jobs = jobs or default_jobs()
+    converted = 0
+    with open(manifest, 'w') as ligands, open(error_log, 'a') as errors, ThreadPoolExecutor(max_workers=jobs) as executor, \
+            tqdm(desc="Converting ligands", unit=" ligands") as progress:
+        chunks = iter_named_chunks(sdf_paths, out_dir, chunk_size, shard_size)
+        for (_, chunk), future in imap_bounded(executor, convert_chunk, chunks, jobs * 2):
+            written, failed = future.result()
+            for path in written:
+                ligands.write(path + '\n')
+            for name in failed:
+                errors.write(f"{name}: obabel produced no PDBQT output\n")
+            ligands.flush()
+            converted += len(written)
+            progress.update(len(chunk))
+    print(f"Converted {converted} ligands into {out_dir}, listed in {manifest}")
+    return converted
+
+def convert_ligand(sdf_file, pdbqt_file):
+    """Convert a single-record SDF file to PDBQT. Returns None on success or an error message."""
+    try:
+        result = subprocess.run([OBABEL, "-isdf", sdf_file, "-opdbqt", "-O", pdbqt_file],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        return f"failed to run {OBABEL}: {e}"
+    if result.returncode != 0 or not os.path.exists(pdbqt_file) or os.path.getsize(pdbqt_file) == 0:
+        return result.stderr.strip() or f"exit code {result.returncode}"
+    return None
@@ -0,0 +1,224 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Compressed, append-only archive of Vina logs.
+
+Instead of one <ligand>_log.log per ligand plus a second copy in
+master_log.log, every log is appended to logs.archive as its own zlib record
+and a small SQLite index maps the ligand to the record's offset, so any log is
+read back with one seek. The per-file layout can be recreated at any time:
+
+    python3 Programs/log_archive.py export Log
+    python3 Programs/log_archive.py get 1.pdbqt
+    python3 Programs/log_archive.py list
+"""
+
+import os
+import sys
+import zlib
+import struct
+import sqlite3
+from tqdm import tqdm
+import vina_engine
+
+ARCHIVE_FILE = "logs.archive"
+COMMIT_EVERY = 1000  # records appended between index commits
+
+# Record frame: name length, data length, name (utf-8), zlib data
+FRAME = struct.Struct(">HI")
+
+# Text every Vina log shares, used as a preset zlib dictionary so that small
+# logs compress well on their own. Changing it makes existing archives unreadable.
+ZDICT = b"""#################################################################
+# If you used AutoDock Vina in your work, please cite:          #
+#                                                               #
+# O. Trott, A. J. Olson,                                        #
+# AutoDock Vina: improving the speed and accuracy of docking    #
+# with a new scoring function, efficient optimization and       #
+# multithreading, Journal of Computational Chemistry 31 (2010)  #
+# 455-461                                                       #
+#                                                               #
+# DOI 10.1002/jcc.21334                                         #
+#                                                               #
+# Please see http://vina.scripps.edu for more information.      #
+#################################################################
+
+Detected 8 CPUs
+Reading input ... done.
+Setting up the scoring function ... done.
+Analyzing the binding site ... done.
+Using random seed:
+Performing search ...
+0%   10   20   30   40   50   60   70   80   90   100%
+|----|----|----|----|----|----|----|----|----|----|
+***************************************************
+done.
+Refining results ... done.
+
+mode |   affinity | dist from best mode
+     | (kcal/mol) | rmsd l.b.| rmsd u.b.
+-----+------------+----------+----------
+   1
+   2
+   3
+Writing output ... done.
+"""
+
+def compress(text):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, ZDICT)
+    return compressor.compress(text.encode()) + compressor.flush()
+
+def decompress(data):
+    decompressor = zlib.decompressobj(15, ZDICT)
+    return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+class LogArchive:
+    """Append-only store of Vina logs with an offset index next to it (<path>.index).
+
+    Only one process should append at a time. Re-adding a ligand appends a new
+    record and points the index at it; the old bytes stay until compact().
+    """
+
+    def __init__(self, path=ARCHIVE_FILE):
+        self.path = path
+        self.data = open(path, 'a+b')
+        self.db = sqlite3.connect(path + ".index", timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS logs (ligand TEXT PRIMARY KEY, offset INTEGER, length INTEGER)")
+        self.db.commit()
+        self.uncommitted = 0
+        self.recover()
+
+    def recover(self):
+        """Index records appended after the last index commit and drop a torn final record."""
+        end = self.db.execute("SELECT COALESCE(MAX(offset + length), 0) FROM logs").fetchone()[0]
+        size = os.path.getsize(self.path)
+        self.data.seek(end)
+        recovered = 0
+        while end + FRAME.size <= size:
+            name_length, data_length = FRAME.unpack(self.data.read(FRAME.size))
+            offset = end + FRAME.size + name_length
+            if offset + data_length > size:
+                break
+            name = self.data.read(name_length).decode()
+            self.data.seek(data_length, os.SEEK_CUR)
+            self.db.execute("INSERT OR REPLACE INTO logs VALUES (?, ?, ?)", (name, offset, data_length))
+            end = offset + data_length
+            recovered += 1
+        if end < size:
+            self.data.truncate(end)
+        self.db.commit()
+        if recovered:
+            print(f"Recovered {recovered} log records missing from the {self.path} index")
+
+    def add(self, ligand, log):
+        """Append one ligand's log and index it."""
+        name = ligand.encode()
+        data = compress(log)
+        self.data.seek(0, os.SEEK_END)
+        offset = self.data.tell() + FRAME.size + len(name)
+        self.data.write(FRAME.pack(len(name), len(data)) + name + data)
+        self.db.execute("INSERT OR REPLACE INTO logs VALUES (?, ?, ?)", (ligand, offset, len(data)))
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Make appended records durable, then commit their index entries."""
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        self.db.commit()
+        self.uncommitted = 0
+
+    def read(self, offset, length):
+        self.data.seek(offset)
+        return decompress(self.data.read(length))
+
+    def get(self, ligand):
+        """The archived log text of one ligand, or None if it is not in the archive."""
+        row = self.db.execute("SELECT offset, length FROM logs WHERE ligand = ?", (ligand,)).fetchone()
+        return self.read(*row) if row is not None else None
+
+    def __contains__(self, ligand):
+        return self.db.execute("SELECT 1 FROM logs WHERE ligand = ?", (ligand,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+
+    def items(self):
+        """(ligand, log) for every archived ligand, read sequentially in file order."""
+        rows = self.db.execute("SELECT ligand, offset, length FROM logs ORDER BY offset")
+        for ligand, offset, length in rows:
+            yield ligand, self.read(offset, length)
+
+    def export(self, output_dir=None):
+        """Write every log back out as <ligand>_log.log, the layout dataan.py expects."""
+        self.flush()
+        count = 0
+        for ligand, log in tqdm(self.items(), total=len(self), desc="Exporting logs"):
+            log_file = vina_engine.log_path(ligand, output_dir)
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            with open(log_file, 'w') as f:
+                f.write(log)
+            count += 1
+        return count
+
+    def compact(self):
+        """Rewrite the archive without records superseded by a later add()."""
+        self.flush()
+        tmp = self.path + ".tmp"
+        if os.path.exists(tmp + ".index"):
+            os.remove(tmp + ".index")
+        compacted = LogArchive(tmp)
+        for ligand, log in self.items():
+            compacted.add(ligand, log)
+        compacted.close()
+        self.close()
+        os.replace(tmp, self.path)
+        os.replace(tmp + ".index", self.path + ".index")
+        self.__init__(self.path)
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.db.close()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in ("export", "get", "list", "compact"):
+        print("Usage: python3 Programs/log_archive.py export [directory] | get <ligand> | list | compact")
+        return 1
+    archive = LogArchive()
+    try:
+        if argv[0] == "export":
+            count = archive.export(argv[1] if len(argv) > 1 else None)
+            print(f"Exported {count} logs")
+        elif argv[0] == "get":
+            log = archive.get(argv[1])
+            if log is None:
+                print(f"{argv[1]} is not in {ARCHIVE_FILE}")
+                return 1
+            print(log, end='')
+        elif argv[0] == "list":
+            for (ligand,) in archive.db.execute("SELECT ligand FROM logs ORDER BY offset"):
+                print(ligand)
+        else:
+            archive.compact()
+    finally:
+        archive.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Merge the rankings of several docking runs or shards into one.
+
+Each input is a results.txt written by dataan.py or a results_index.sqlite;
+both are already sorted best first, so they are streamed through a k-way heap
+merge and never loaded whole. A CID found in several inputs keeps its best
+score.
+
+    python3 Programs/merge_results.py -o merged.csv runA/results.txt runB/results.txt
+    python3 Programs/merge_results.py -o merged.jsonl nodes/*/results_index.sqlite
+"""
+
+import os
+import sys
+import csv
+import json
+import heapq
+import sqlite3
+import argparse
+
+def iter_results_txt(path):
+    """(affinity, cid) rows of a dataan.py results.txt, checking they are sorted."""
+    previous = float("-inf")
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if number <= 2 or not line.strip():
+                continue  # column header and ===== rule
+            cid, _, affinity = line.partition('|')
+            affinity = float(affinity)
+            if affinity < previous:
+                raise ValueError(f"{path} is not sorted by affinity at line {number}")
+            previous = affinity
+            yield affinity, cid.strip()
+
+def iter_results_index(path):
+    """(affinity, cid) rows of a results_index.sqlite, best first."""
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        yield from db.execute("SELECT best, cid FROM logs WHERE best IS NOT NULL ORDER BY best")
+    finally:
+        db.close()
+
+def iter_source(path):
+    """(affinity, cid, path) rows of one input, best first."""
+    rows = iter_results_index(path) if path.endswith((".sqlite", ".db")) else iter_results_txt(path)
+    for affinity, cid in rows:
+        yield affinity, cid, path
+
+def merge_results(paths, dedupe=True):
+    """Yield (cid, affinity, source path) over all inputs, best first.
+
+    Memory is constant in the number of rows, except for deduplication, which
+    keeps the set of CIDs already written (the first, and so best, occurrence
+    of each CID wins).
+    """
+    seen = set()
+    for affinity, cid, path in heapq.merge(*(iter_source(path) for path in paths)):
+        if dedupe:
+            if cid in seen:
+                continue
+            seen.add(cid)
+        yield cid, affinity, path
+
+def write_merged(rows, output_file, output_format=None):
+    """Write merged rows as CSV or JSON lines (chosen by the output extension by default)."""
+    output_format = output_format or ("jsonl" if output_file.endswith((".jsonl", ".json")) else "csv")
+    count = 0
+    tmp = output_file + ".tmp"
+    try:
+        with open(tmp, 'w', newline='') as f:
+            if output_format == "csv":
+                writer = csv.writer(f)
+                writer.writerow(["rank", "cid", "affinity_kcal_mol", "source"])
+                for count, (cid, affinity, source) in enumerate(rows, 1):
+                    writer.writerow([count, cid, affinity, source])
+            else:
+                for count, (cid, affinity, source) in enumerate(rows, 1):
+                    f.write(json.dumps({"rank": count, "cid": cid, "affinity": affinity, "source": source}) + '\n')
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, output_file)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge sorted results.txt files or results indexes from several docking runs")
+    parser.add_argument("inputs", nargs='+', help="results.txt files or results_index.sqlite indexes")
+    parser.add_argument("-o", "--output", default="merged_results.csv", help="output file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None)
+    parser.add_argument("--keep-duplicates", action="store_true", help="write every occurrence of a CID")
+    args = parser.parse_args(argv)
+    try:
+        count = write_merged(merge_results(args.inputs, dedupe=not args.keep_duplicates), args.output, args.format)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Merge failed: {e}")
+        return 1
+    print(f"Merged {count} ligands from {len(args.inputs)} inputs into {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
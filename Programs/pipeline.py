@@ -0,0 +1,209 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Headless docking pipeline. Every ligand flows through minimize -> convert ->
+dock -> split -> affinity extraction on its own, with bounded queues between
+the stages, so preparation overlaps with docking and results appear early.
+
+Usage: python3 Programs/pipeline.py pipeline.ini
+
+Example pipeline.ini:
+
+    [pipeline]
+    directory = /path/to/work
+    ligands = *.sdf
+    conf = conf.txt
+    minimize = yes
+    dock_jobs = 4
+    cpu_per_job = 4
+    prep_jobs = 2
+    queue_size = 64
+"""
+
+import os
+import sys
+import glob
+import queue
+import threading
+import configparser
+from tqdm import tqdm
+import vina_engine
+import ligand_prep
+import poses
+import dataan
+
+STOP = object()
+
+DEFAULTS = {
+    "directory": ".",
+    "ligands": "*.sdf",
+    "conf": vina_engine.CONF_FILE,
+    "minimize": "yes",
+    "dock_jobs": "0",
+    "cpu_per_job": str(vina_engine.CPU_PER_JOB),
+    "prep_jobs": "2",
+    "queue_size": "64",
+    "results": "pipeline_results.txt",
+    "errors": "pipeline_errors.log",
+}
+
+def read_pipeline_config(config_file):
+    """Read the [pipeline] section of an INI file, filling in defaults."""
+    parser = configparser.ConfigParser(defaults=DEFAULTS)
+    if not parser.read(config_file):
+        raise FileNotFoundError(f"Cannot read pipeline config {config_file}")
+    section = parser["pipeline"] if parser.has_section("pipeline") else parser[parser.default_section]
+    return {
+        "directory": section.get("directory"),
+        "ligands": section.get("ligands"),
+        "conf": section.get("conf"),
+        "minimize": section.getboolean("minimize"),
+        "dock_jobs": section.getint("dock_jobs"),
+        "cpu_per_job": section.getint("cpu_per_job"),
+        "prep_jobs": section.getint("prep_jobs"),
+        "queue_size": section.getint("queue_size"),
+        "results": section.get("results"),
+        "errors": section.get("errors"),
+    }
+
+def run_stage(fn, inbox, outbox, workers, on_error):
+    """Start workers that apply fn to items from inbox and pass the results to outbox.
+
+    fn returns the item for the next stage or raises to drop it. When every
+    worker has seen STOP, STOP is passed on downstream. Returns the threads.
+    """
+    def work():
+        while True:
+            item = inbox.get()
+            if item is STOP:
+                inbox.put(STOP)  # let the other workers of this stage see it too
+                return
+            try:
+                outbox.put(fn(item))
+            except Exception as e:
+                on_error(item, e)
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    def finish():
+        for thread in threads:
+            thread.join()
+        outbox.put(STOP)
+
+    closer = threading.Thread(target=finish, daemon=True)
+    closer.start()
+    return threads + [closer]
+
+def run_pipeline(config):
+    """Run the whole docking workflow on every ligand as it becomes ready."""
+    os.chdir(config["directory"])
+    conf_file = config["conf"]
+    cpu_per_job = max(1, config["cpu_per_job"])
+    dock_jobs = config["dock_jobs"] or max(1, (os.cpu_count() or 1) // cpu_per_job)
+    prep_jobs = max(1, config["prep_jobs"])
+    sdf_files = sorted(glob.glob(config["ligands"]))
+    os.makedirs(poses.FIRST_POSE_DIR, exist_ok=True)
+    os.makedirs(poses.OTHER_POSE_DIR, exist_ok=True)
+
+    error_lock = threading.Lock()
+    errors = open(config["errors"], 'a')
+
+    def on_error(ligand, error):
+        with error_lock:
+            errors.write(f"{ligand['name']}: {error}\n")
+            errors.flush()
+
+    def prepare(ligand):
+        os.makedirs(ligand["shard"], exist_ok=True)
+        ligand["sdf"] = os.path.join(ligand["shard"], ligand["name"] + ".sdf")
+        with open(ligand["sdf"], 'w') as f:
+            f.write(ligand.pop("record") + "$$$$\n")
+        if config["minimize"]:
+            minimized = ligand_prep.minimized_path(ligand["sdf"])
+            error = ligand_prep.minimize_ligand(ligand["sdf"], output_file=minimized)
+            if error:
+                raise RuntimeError(f"minimization: {error}")
+            ligand["sdf"] = minimized
+        return ligand
+
+    def convert(ligand):
+        ligand["pdbqt"] = os.path.join(ligand["shard"], ligand["name"] + ".pdbqt")
+        error = ligand_prep.convert_ligand(ligand["sdf"], ligand["pdbqt"])
+        if error:
+            raise RuntimeError(f"conversion: {error}")
+        return ligand
+
+    def dock(ligand):
+        returncode, _ = vina_engine.run_vina(ligand["pdbqt"], conf_file, cpu_per_job)
+        if returncode != 0:
+            raise RuntimeError(f"Vina exited with code {returncode}")
+        return ligand
+
+    def split(ligand):
+        out_file = vina_engine.out_path(ligand["pdbqt"])
+        poses.split_pose_file(out_file, poses.FIRST_POSE_DIR, poses.OTHER_POSE_DIR)
+        result = dataan.parse_log_file(vina_engine.log_path(ligand["pdbqt"]))
+        if result is None:
+            raise RuntimeError("no affinity in the Vina log")
+        return result
+
+    size = max(1, config["queue_size"])
+    source, prepared, converted, docked, split_done = (queue.Queue(maxsize=size) for _ in range(5))
+    run_stage(prepare, source, prepared, prep_jobs, on_error)
+    run_stage(convert, prepared, converted, prep_jobs, on_error)
+    run_stage(dock, converted, docked, dock_jobs, on_error)
+    run_stage(split, docked, split_done, prep_jobs, on_error)
+
+    feed_errors = []
+
+    def feed():
+        try:
+            for shard, chunk in ligand_prep.iter_named_chunks(sdf_files, chunk_size=1):
+                for name, record in chunk:
+                    source.put({"name": name, "shard": shard, "record": record})
+        except Exception as e:
+            feed_errors.append(e)
+            on_error({"name": "reading ligand files"}, e)
+            print(f"Error reading the ligand files: {e}")
+        finally:
+            source.put(STOP)  # ligands already queued still finish
+
+    threading.Thread(target=feed, daemon=True).start()
+    print(f"Pipeline: {prep_jobs} preparation workers, {dock_jobs} Vina jobs with {cpu_per_job} CPU each")
+
+    ranked = []
+    with open(config["results"], 'w') as out, tqdm(desc="Ligands docked", unit=" ligands") as progress:
+        while True:
+            result = split_done.get()
+            if result is STOP:
+                break
+            ranked.append(result)
+            out.write(f"{result[0]}\t{result[1]}\n")
+            out.flush()
+            progress.update(1)
+    errors.close()
+    dataan.write_results(ranked, '.')
+    if feed_errors:
+        raise RuntimeError(f"Pipeline stopped early, reading the ligand files failed: {feed_errors[0]}")
+    return ranked
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 Programs/pipeline.py pipeline.ini")
+        sys.exit(1)
+    run_pipeline(read_pipeline_config(sys.argv[1]))
@@ -0,0 +1,339 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Pose RMSD and clustering over Vina output files.
+
+Heavy-atom coordinates of every MODEL in every *_out.pdbqt are packed into one
+contiguous float32 file that is memory-mapped, so large screens never have to
+fit in memory. RMSDs are computed in place (no superposition), as Vina's own
+rmsd l.b./u.b. columns are, since all poses share the receptor frame.
+
+Poses of one ligand are clustered greedily by affinity at a cutoff. Bonds are
+inferred from each ligand's geometry and side chains are stripped down to its
+framework (ring systems and the linkers between them). Ligands with the same
+framework have their best poses clustered across ligands the same way, with the
+RMSD taken over the framework atoms matched onto a reference ligand.
+
+    python3 Programs/pose_cluster.py /path/to/docking/directory [cutoff]
+"""
+
+import os
+import sys
+import glob
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import poses
+import vinalog
+import ligand_filter
+from workers import default_jobs, imap_bounded
+
+CLUSTER_DIR = "PoseClusters"
+RMSD_CUTOFF = 2.0  # Angstrom
+CLUSTER_REPORT = "pose_clusters.txt"
+
+HYDROGEN_TYPES = {"H", "HD", "HS"}
+# AutoDock atom types that are not plain element symbols
+AD_ELEMENTS = {"A": "C", "NA": "N", "NS": "N", "OA": "O", "OS": "O", "SA": "S", "G0": "C", "G1": "C", "G2": "C", "G3": "C", "CG0": "C"}
+COVALENT_RADII = {"C": 0.76, "N": 0.71, "O": 0.66, "S": 1.05, "P": 1.07, "F": 0.57, "Cl": 1.02, "Br": 1.20, "I": 1.39, "B": 0.84, "Si": 1.11, "Se": 1.20}
+BOND_TOLERANCE = 0.45  # Angstrom added to the sum of covalent radii
+
+def cid_from_out(out_file):
+    """CID of a Vina output file, matching the name dataan.py gives its log."""
+    name = os.path.basename(out_file)
+    if name.endswith("_out.pdbqt"):
+        name = name[:-len("_out.pdbqt")]
+    return vinalog.cid_from_log(name)
+
+def parse_pose_file(out_file):
+    """Read (heavy-atom element signature, affinities, coordinates) from one output file.
+
+    Coordinates have shape (models, heavy atoms, 3). Raises ValueError if the
+    models do not all list the same atoms.
+    """
+    signature, affinities, models = None, [], []
+    for model in poses.iter_models(out_file):
+        elements, coords, affinity = [], [], None
+        for line in model:
+            if line.startswith("REMARK VINA RESULT:"):
+                affinity = float(line.split()[3])
+            elif line.startswith(("ATOM", "HETATM")):
+                atom_type = line[77:79].strip()
+                if atom_type in HYDROGEN_TYPES:
+                    continue
+                elements.append(AD_ELEMENTS.get(atom_type, atom_type))
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        model_signature = ','.join(elements)
+        if signature is None:
+            signature = model_signature
+        elif model_signature != signature:
+            raise ValueError("models have different atoms")
+        affinities.append(affinity if affinity is not None else np.nan)
+        models.append(coords)
+    if not models:
+        raise ValueError("no poses")
+    return signature, np.array(affinities, dtype=np.float32), np.array(models, dtype=np.float32).reshape(len(models), -1, 3)
+
+def infer_bonds(elements, coords):
+    """Heavy-atom bonds (a, b, 1) of one pose, from interatomic distances."""
+    radii = np.array([COVALENT_RADII.get(element, 0.8) for element in elements])
+    distances = np.sqrt(((coords[:, None, :] - coords[None, :, :]) ** 2).sum(axis=-1))
+    a, b = np.nonzero(np.triu(distances < radii[:, None] + radii[None, :] + BOND_TOLERANCE, 1))
+    return [(int(i), int(j), 1) for i, j in zip(a, b)]
+
+def framework(elements, coords):
+    """(framework atom indices, framework bonds, graph, key) of one pose, or None for an acyclic ligand.
+
+    Atoms with at most one bond are stripped until none are left, which leaves
+    the ring systems and the linkers between them. Bonds are numbered over the
+    framework atoms. The key and graph come from ligand_filter.canonical_hash,
+    so frameworks with the same key can be matched atom by atom with
+    ligand_filter.match_atoms.
+    """
+    bonds = infer_bonds(elements, coords)
+    neighbours = [set() for _ in elements]
+    for a, b, _ in bonds:
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+    alive = set(range(len(elements)))
+    terminal = [atom for atom in alive if len(neighbours[atom]) <= 1]
+    while terminal:
+        atom = terminal.pop()
+        if atom not in alive:
+            continue
+        alive.discard(atom)
+        for other in neighbours[atom]:
+            neighbours[other].discard(atom)
+            if other in alive and len(neighbours[other]) <= 1:
+                terminal.append(other)
+    if not alive:
+        return None
+    atoms = sorted(alive)
+    number = {atom: index for index, atom in enumerate(atoms)}
+    core_bonds = [(number[a], number[b], 1) for a, b, _ in bonds if a in number and b in number]
+    digest, graph = ligand_filter.canonical_hash([elements[atom] for atom in atoms], [0] * len(atoms), core_bonds)
+    return atoms, core_bonds, graph, digest.hex()
+
+def best_pose_number(affinities):
+    """Index of the best-scoring pose; poses without a score come last."""
+    return int(np.argmin(np.nan_to_num(affinities, nan=np.inf)))
+
+def parse_chunk(out_files):
+    parsed = []
+    for out_file in out_files:
+        try:
+            signature, affinities, coords = parse_pose_file(out_file)
+            # the best pose is the one matched across ligands, so its framework is the one kept
+            core = framework(signature.split(','), coords[best_pose_number(affinities)])
+            atoms, bonds, _, key = core if core else ([], [], None, "")
+            parsed.append((out_file, (signature, key, atoms, [bond[:2] for bond in bonds], affinities, coords), None))
+        except (OSError, ValueError, IndexError) as e:
+            parsed.append((out_file, None, str(e)))
+    return parsed
+
+def build_pose_table(out_files, output_dir=CLUSTER_DIR, jobs=None, chunk_size=64):
+    """Parse output files in parallel into output_dir/coords.f32 and output_dir/poses.npz.
+
+    poses.npz holds, per ligand, its CID, source file, element signature,
+    framework key ("" for acyclic ligands), first pose row, number of poses and
+    atoms, and the framework atoms and bonds of its best pose; and per pose its
+    affinity.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = jobs or default_jobs()
+    cids, files, signatures, scaffolds, starts, counts, atoms, affinities = [], [], [], [], [], [], [], []
+    core_atoms, core_atom_counts, core_bonds, core_bond_counts = [], [], [], []
+    offset = 0
+    with open(os.path.join(output_dir, "coords.f32"), 'wb') as coords_file, ProcessPoolExecutor(max_workers=jobs) as executor, \
+            tqdm(total=len(out_files), desc="Reading poses", unit=" files") as progress:
+        for chunk, future in imap_bounded(executor, parse_chunk, vinalog.iter_chunks(out_files, chunk_size), jobs * 2):
+            for out_file, parsed, error in future.result():
+                if error is not None:
+                    print(f"Skipping {out_file}: {error}")
+                    continue
+                signature, scaffold, framework_atoms, framework_bonds, pose_affinities, coords = parsed
+                coords_file.write(coords.tobytes())
+                cids.append(cid_from_out(out_file))
+                files.append(out_file)
+                signatures.append(signature)
+                scaffolds.append(scaffold)
+                starts.append(offset)
+                counts.append(coords.shape[0])
+                atoms.append(coords.shape[1])
+                affinities.append(pose_affinities)
+                core_atoms.extend(framework_atoms)
+                core_atom_counts.append(len(framework_atoms))
+                core_bonds.extend(framework_bonds)
+                core_bond_counts.append(len(framework_bonds))
+                offset += coords.size
+            progress.update(len(chunk))
+    np.savez(os.path.join(output_dir, "poses.npz"), cids=np.array(cids, dtype=str), files=np.array(files, dtype=str),
+             signatures=np.array(signatures, dtype=str), scaffolds=np.array(scaffolds, dtype=str), starts=np.array(starts, dtype=np.int64),
+             counts=np.array(counts, dtype=np.int32), atoms=np.array(atoms, dtype=np.int32),
+             affinities=np.concatenate(affinities) if affinities else np.zeros(0, dtype=np.float32),
+             core_atoms=np.array(core_atoms, dtype=np.int32), core_atom_counts=np.array(core_atom_counts, dtype=np.int32),
+             core_bonds=np.array(core_bonds, dtype=np.int32).reshape(-1, 2), core_bond_counts=np.array(core_bond_counts, dtype=np.int32))
+    return load_pose_table(output_dir)
+
+class PoseTable:
+    """Memory-mapped coordinates plus the per-ligand layout written by build_pose_table."""
+
+    def __init__(self, output_dir=CLUSTER_DIR):
+        with np.load(os.path.join(output_dir, "poses.npz"), allow_pickle=False) as data:
+            for name in ("cids", "files", "signatures", "scaffolds", "starts", "counts", "atoms", "affinities",
+                         "core_atoms", "core_atom_counts", "core_bonds", "core_bond_counts"):
+                setattr(self, name, data[name])
+        coords_path = os.path.join(output_dir, "coords.f32")
+        self.coords = np.memmap(coords_path, dtype=np.float32, mode='r') if os.path.getsize(coords_path) else np.zeros(0, np.float32)
+        self.pose_starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.core_atom_starts = np.concatenate(([0], np.cumsum(self.core_atom_counts)[:-1])).astype(np.int64)
+        self.core_bond_starts = np.concatenate(([0], np.cumsum(self.core_bond_counts)[:-1])).astype(np.int64)
+
+    def __len__(self):
+        return len(self.cids)
+
+    def ligand_coords(self, index):
+        """(poses, atoms, 3) coordinates of one ligand, a view into the memory map."""
+        start, count, atoms = self.starts[index], self.counts[index], self.atoms[index]
+        return self.coords[start:start + count * atoms * 3].reshape(count, atoms, 3)
+
+    def ligand_affinities(self, index):
+        start = self.pose_starts[index]
+        return self.affinities[start:start + self.counts[index]]
+
+    def best_pose(self, index):
+        """(pose number, affinity) of the best-scoring pose of one ligand."""
+        affinities = self.ligand_affinities(index)
+        pose = best_pose_number(affinities)
+        return pose, float(affinities[pose])
+
+    def framework(self, index):
+        """(framework atom indices, framework graph) stored for one ligand's best pose, or None if it has none."""
+        count = self.core_atom_counts[index]
+        if not count:
+            return None
+        start = self.core_atom_starts[index]
+        atoms = self.core_atoms[start:start + count].tolist()
+        start = self.core_bond_starts[index]
+        bonds = [(int(a), int(b), 1) for a, b in self.core_bonds[start:start + self.core_bond_counts[index]]]
+        elements = self.signatures[index].split(',')
+        _, graph = ligand_filter.canonical_hash([elements[atom] for atom in atoms], [0] * count, bonds)
+        return atoms, graph
+
+def load_pose_table(output_dir=CLUSTER_DIR):
+    return PoseTable(output_dir)
+
+def pairwise_rmsd(coords):
+    """(n, n) RMSD matrix between n poses of shape (n, atoms, 3), without superposition."""
+    diff = coords[:, None, :, :] - coords[None, :, :, :]
+    return np.sqrt((diff ** 2).sum(axis=-1).mean(axis=-1))
+
+def rmsd_to(reference, coords):
+    """RMSD of each pose in coords (n, atoms, 3) to one reference pose (atoms, 3)."""
+    return np.sqrt(((coords - reference) ** 2).sum(axis=-1).mean(axis=-1))
+
+def greedy_clusters(coords, cutoff=RMSD_CUTOFF):
+    """Cluster poses already sorted best first: each unassigned pose leads a new cluster
+    of every unassigned pose within cutoff of it. Returns the leader index of every pose."""
+    leaders = np.full(len(coords), -1, dtype=np.int64)
+    for index in range(len(coords)):
+        if leaders[index] != -1:
+            continue
+        unassigned = np.flatnonzero(leaders == -1)
+        leaders[unassigned[rmsd_to(coords[index], coords[unassigned]) <= cutoff]] = index
+    return leaders
+
+def core_coords(table, members, best):
+    """Framework coordinates of each member's best pose in the atom order of the first member.
+
+    Uses the frameworks stored by build_pose_table, which were taken from the
+    same best poses. Returns (members matched, (members, framework atoms, 3)
+    coordinates). Atoms are matched nearest first, so symmetric rings map onto
+    the reference the way they lie in the pocket. Members without a framework,
+    or whose framework only shares the key with the reference, are left out.
+    """
+    def best_coords(index):
+        return np.asarray(table.ligand_coords(index))[best[index][0]]
+    frameworks = {index: table.framework(index) for index in members}
+    members = [index for index in members if frameworks[index] is not None]
+    if not members:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0, 3), dtype=np.float32)
+    reference = best_coords(members[0])
+    reference_atoms, reference_graph = frameworks[members[0]]
+    matched, stacked = [], []
+    for index in members:
+        coords = best_coords(index)
+        atoms, graph = frameworks[index]
+        def nearest(atom, candidates):
+            target = reference[reference_atoms[atom]]
+            return sorted(candidates, key=lambda candidate: float(((coords[atoms[candidate]] - target) ** 2).sum()))
+        mapping = ligand_filter.match_atoms(reference_graph, graph, nearest)
+        if mapping is None:
+            continue
+        matched.append(index)
+        stacked.append(coords[[atoms[mapping[atom]] for atom in range(len(reference_atoms))]])
+    return np.array(matched, dtype=np.int64), np.stack(stacked)
+
+def cluster_table(table, cutoff=RMSD_CUTOFF):
+    """Distinct poses per ligand, and the scaffold cluster leader of each ligand's best pose.
+
+    Returns (number of pose clusters per ligand, leader ligand index per ligand).
+    """
+    distinct = np.zeros(len(table), dtype=np.int32)
+    for index in tqdm(range(len(table)), desc="Clustering poses within ligands"):
+        coords = np.asarray(table.ligand_coords(index))
+        order = np.argsort(table.ligand_affinities(index), kind="stable")
+        distinct[index] = len(np.unique(greedy_clusters(coords[order], cutoff)))
+
+    scaffold_leader = np.arange(len(table))
+    best = [table.best_pose(index) for index in range(len(table))]
+    best_affinity = np.array([affinity for _, affinity in best])
+    for scaffold in tqdm(np.unique(table.scaffolds), desc="Clustering across scaffolds"):
+        members = np.flatnonzero(table.scaffolds == scaffold)
+        if not scaffold or len(members) < 2:
+            continue
+        members = members[np.argsort(best_affinity[members], kind="stable")]
+        members, cores = core_coords(table, members, best)
+        if len(members):
+            scaffold_leader[members] = members[greedy_clusters(cores, cutoff)]
+    return distinct, scaffold_leader
+
+def write_cluster_report(table, distinct, scaffold_leader, output_file=CLUSTER_REPORT):
+    """The dataan.py ranking, with each ligand's distinct pose count and scaffold cluster representative."""
+    best_affinity = np.array([table.best_pose(index)[1] for index in range(len(table))])
+    col_widths = [15, 20, 15, 20]
+    with open(output_file, 'w') as f:
+        f.write(' | '.join(str(item).ljust(width) for item, width in
+                           zip(["CID", "Affinity (kcal/mol)", "Distinct poses", "Representative"], col_widths)) + '\n')
+        f.write('=' * 80 + '\n')
+        for index in np.argsort(best_affinity, kind="stable"):
+            row = (table.cids[index], round(float(best_affinity[index]), 3), int(distinct[index]), table.cids[scaffold_leader[index]])
+            f.write(' | '.join(str(item).ljust(width) for item, width in zip(row, col_widths)) + '\n')
+    print("Pose clusters written to", output_file)
+
+def cluster_directory(directory, cutoff=RMSD_CUTOFF, jobs=None):
+    """Cluster every *_out.pdbqt in directory and write pose_clusters.txt beside results.txt."""
+    out_files = sorted(glob.glob(os.path.join(directory, "*_out.pdbqt")))
+    table = build_pose_table(out_files, os.path.join(directory, CLUSTER_DIR), jobs)
+    distinct, scaffold_leader = cluster_table(table, cutoff)
+    write_cluster_report(table, distinct, scaffold_leader, os.path.join(directory, CLUSTER_REPORT))
+    return table, distinct, scaffold_leader
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 Programs/pose_cluster.py <directory with *_out.pdbqt> [RMSD cutoff]")
+        sys.exit(1)
+    cluster_directory(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else RMSD_CUTOFF)
@@ -0,0 +1,72 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from workers import default_jobs
+
+FIRST_POSE_DIR = "01_Docking_Pose"
+OTHER_POSE_DIR = "Other_Docking_Pose"
+
+def iter_models(path):
+    """Stream a multi-model PDBQT file, yielding the lines inside each MODEL/ENDMDL block.
+
+    A file without MODEL records is treated as a single model.
+    """
+    model = []
+    in_model = False
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith("MODEL"):
+                in_model = True
+                model = []
+            elif line.startswith("ENDMDL"):
+                in_model = False
+                yield model
+                model = None
+            elif model is not None:
+                model.append(line)
+    if model and not in_model:
+        yield model  # no MODEL records at all
+
+def pose_file_name(out_file, pose):
+    """Name vina_split gives to a pose: 123_out.pdbqt -> 123_out_ligand_01.pdbqt."""
+    stem = os.path.splitext(os.path.basename(out_file))[0]
+    return f"{stem}_ligand_{pose:02d}.pdbqt"
+
+def split_pose_file(out_file, first_dir=FIRST_POSE_DIR, other_dir=OTHER_POSE_DIR):
+    """Split one Vina output file, writing pose 1 to first_dir and the rest to other_dir.
+
+    Returns the number of poses written.
+    """
+    poses = 0
+    for poses, model in enumerate(iter_models(out_file), 1):
+        folder = first_dir if poses == 1 else other_dir
+        with open(os.path.join(folder, pose_file_name(out_file, poses)), 'w') as f:
+            f.writelines(model)
+    return poses
+
+def split_pose_files(out_files, first_dir=FIRST_POSE_DIR, other_dir=OTHER_POSE_DIR, jobs=None):
+    """Split many output files in parallel without spawning vina_split. Returns the total pose count."""
+    os.makedirs(first_dir, exist_ok=True)
+    os.makedirs(other_dir, exist_ok=True)
+    jobs = jobs or default_jobs()
+    chunksize = max(1, min(256, len(out_files) // (jobs * 4) or 1))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        counts = executor.map(split_pose_file, out_files, [first_dir] * len(out_files), [other_dir] * len(out_files), chunksize=chunksize)
+        return sum(tqdm(counts, total=len(out_files), desc="Splitting output files"))
@@ -0,0 +1,465 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+PubChem download engine used by the GUI downloader (gui.py), usable without Qt:
+
+    python3 Programs/pubchem.py names.txt downloads --format sdf
+    python3 Programs/pubchem.py failed_cids.txt downloads --cids
+
+Names are read lazily and only a bounded number of lookups are in flight, so
+lists of hundreds of thousands of compounds run in constant memory. Each name
+is resolved to a CID, and records are fetched (RECORD_BATCH_SIZE CIDs per
+request for SDF and JSON) and written to <save folder>/<cid>.<format> in chunks.
+
+Lookups and records are kept in a local cache (pubchem_cache.py), so names and
+compounds fetched by an earlier run are served from disk and only new ones
+reach PubChem. --offline uses the cache alone.
+
+    python3 Programs/pubchem.py names.txt downloads --offline
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from tqdm import tqdm
+from pubchem_cache import PubchemCache, TTL_DAYS, MAX_CACHE_BYTES
+
+MAX_RETRIES = 20  # Attempts for a request PubChem answers with 429/503
+CONNECTION_RETRIES = 3  # urllib3 retries for dropped connections and 500/502/504
+RETRY_DELAY = 3  # Delay between retries in seconds
+MAX_CONCURRENT_REQUESTS = 10 # Maximum number of concurrent requests
+MAX_REQUESTS_PER_SECOND = 5  # PubChem usage policy
+MIN_REQUESTS_PER_SECOND = 0.5
+BLOCKED_PAUSE = 60  # seconds to back off when PubChem reports a Black (blocked) status
+PUG_REST = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+RECORD_BATCH_SIZE = 100  # CIDs fetched per record request
+BATCHED_TYPES = ("sdf", "json")  # formats whose multi-record responses can be split locally
+CHUNK_BYTES = 64 * 1024  # write size for streamed record downloads
+ERROR_LOG = "download_errors.log"
+CID_LIST = "cid_list.txt"
+# record failures worth retrying: throttled (429, 503), timed out (504), dropped connections and timeouts,
+# or not cached during an offline run
+RETRYABLE_ERROR = re.compile(r"^Failed to download (\d+)\.\w+: (?:429\b|503\b|504\b|connection failed|not in cache)")
+OFFLINE = os.environ.get("RESHELP_PUBCHEM_OFFLINE", "") == "1"  # lets the GUI run from the cache alone
+
+def split_sdf_records(data):
+    """Split a multi-record SDF response into {cid: record bytes}."""
+    records = {}
+    for record in data.split(b"$$$$\n"):
+        if not record.strip():
+            continue
+        lines = record.split(b"\n")
+        cid = lines[0].strip().decode()
+        for number, line in enumerate(lines[:-1]):
+            if line.startswith(b"> <PUBCHEM_COMPOUND_CID>"):
+                cid = lines[number + 1].strip().decode()
+                break
+        records[cid] = record.lstrip(b"\n") + b"$$$$\n"
+    return records
+
+def split_json_records(data):
+    """Split a multi-record PC_Compounds JSON response into {cid: record bytes}."""
+    records = {}
+    for compound in json.loads(data).get("PC_Compounds", []):
+        cid = str(compound["id"]["id"]["cid"])
+        records[cid] = json.dumps({"PC_Compounds": [compound]}, indent=2).encode()
+    return records
+
+def split_records(data, file_type):
+    return split_sdf_records(data) if file_type == "sdf" else split_json_records(data)
+
+def make_session(pool_size=MAX_CONCURRENT_REQUESTS):
+    """One keep-alive session with a connection pool per download run, so requests reuse TCP/TLS connections."""
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=CONNECTION_RETRIES,
+        backoff_factor=RETRY_DELAY,
+        status_forcelist=[500, 502, 504],  # 429/503 are throttling and handled by RateLimiter
+        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"]  # PUG REST record POSTs are plain lookups
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry_strategy)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class RateLimiter:
+    """Token bucket shared by every PubChem request of a download run.
+
+    Requests start at no more than `rate` per second with at most
+    max_concurrent in flight. The X-Throttling-Control header PubChem sends
+    with each response steers the rate: Green raises it towards
+    MAX_REQUESTS_PER_SECOND, Yellow holds it, Red halves it and Black (or a
+    429/503 reply) halves it and pauses every request for a while.
+    """
+
+    def __init__(self, rate=MAX_REQUESTS_PER_SECOND, max_concurrent=MAX_CONCURRENT_REQUESTS):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self):
+        """Block until a concurrency slot and a token are available."""
+        self.slots.acquire()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def release(self):
+        self.slots.release()
+
+    def slow_down(self, pause=0.0):
+        with self.lock:
+            self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def observe(self, response):
+        """Adapt the rate to the throttling status PubChem reports."""
+        statuses = re.findall(r"\b(Green|Yellow|Red|Black)\b", response.headers.get("X-Throttling-Control", ""))
+        if "Black" in statuses:
+            self.slow_down(BLOCKED_PAUSE)
+        elif "Red" in statuses:
+            self.slow_down()
+        elif statuses and "Yellow" not in statuses:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + 0.25)
+
+    @contextmanager
+    def request(self, method, url, **kwargs):
+        """Send method(url, **kwargs) under the limiter, retrying 429/503 replies with backoff.
+
+        Used as `with limiter.request(...) as response:`; the concurrency slot
+        is held until the block ends and the response is closed, so a streamed
+        body counts against max_concurrent for as long as it is being read.
+        """
+        for attempt in range(MAX_RETRIES):
+            self.acquire()
+            try:
+                response = method(url, **kwargs)
+            except BaseException:
+                self.release()
+                raise
+            self.observe(response)
+            if response.status_code not in (429, 503) or attempt == MAX_RETRIES - 1:
+                break
+            retry_after = response.headers.get("Retry-After", "")
+            response.close()
+            self.release()
+            self.slow_down(float(retry_after) if retry_after.isdigit() else min(RETRY_DELAY * 2 ** attempt, BLOCKED_PAUSE))
+        try:
+            with response:
+                yield response
+        finally:
+            self.release()
+
+class Downloader:
+    """Blocking PubChem requests for one save folder, safe to call from many threads.
+
+    With a cache, lookups and records are read from it first and stored in it
+    once fetched; offline, a cache miss is logged as a failed download.
+    """
+
+    def __init__(self, save_folder, file_type, session=None, limiter=None, cache=None, offline=False):
+        self.save_folder = save_folder
+        self.file_type = file_type
+        self.cache = cache
+        self.offline = offline
+        self.session = session or make_session()
+        self.limiter = limiter or RateLimiter()
+        self.log_file = os.path.join(save_folder, ERROR_LOG)
+        self.log_lock = threading.Lock()
+
+    def log_error(self, error_msg):
+        with self.log_lock, open(self.log_file, 'a') as f:
+            f.write(error_msg + '\n')
+
+    def record_url(self, cid):
+        return f"{PUG_REST}/compound/CID/{cid}/record/{self.file_type}/?record_type=3d"
+
+    def write_record(self, cid, chunks):
+        """Write a record to <cid>.<file_type> chunk by chunk, replacing any old copy atomically."""
+        path = os.path.join(self.save_folder, f"{cid}.{self.file_type}")
+        tmp = path + ".part"
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+        os.replace(tmp, path)
+
+    def resolve_name(self, name):
+        """The first CID PubChem finds for a compound name, or None."""
+        if self.cache is not None:
+            found, cid = self.cache.get_cid(name)
+            if found:
+                if cid is None:
+                    self.log_error(f"Failed to download {self.file_type} file for {name}: not found on PubChem (cached)")
+                return cid
+        if self.offline:
+            self.log_error(f"Failed to download {self.file_type} file for {name}: not in cache (offline)")
+            return None
+        url = f"{PUG_REST}/compound/name/{quote_plus(name)}/cids/JSON?name_type=word"
+        try:
+            with self.limiter.request(self.session.get, url) as response:
+                status_code, reason = response.status_code, response.reason
+                data = response.json() if status_code == 200 else {}
+        except requests.RequestException as e:
+            self.log_error(f"Failed to download {self.file_type} file for {url}: {e}")
+            return None
+        if status_code == 200:
+            if 'IdentifierList' in data:
+                cid = data['IdentifierList']['CID'][0]
+                if self.cache is not None:
+                    self.cache.put_cid(name, cid)
+                return cid
+        else:
+            if status_code == 404 and self.cache is not None:
+                self.cache.put_cid(name, None)  # PubChem has no such name; do not ask again for a while
+            self.log_error(f"Failed to download {self.file_type} file for {url}: {status_code} - {reason}")
+        return None
+
+    def download_record(self, cid):
+        """Stream one CID's record to disk; returns True on success."""
+        filename = f"{cid}.{self.file_type}"
+        try:
+            # holds a request slot and the pooled connection until the body is written
+            with self.limiter.request(self.session.get, self.record_url(cid), stream=True) as response:
+                if response.status_code != 200:
+                    self.log_error(f"Failed to download {filename}: {response.status_code} - {response.reason}")
+                    return False
+                self.write_record(cid, response.iter_content(chunk_size=CHUNK_BYTES))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            self.log_error(f"Failed to download {filename}: connection failed - {e}")
+            return False
+        except requests.RequestException as e:
+            self.log_error(f"Failed to download {filename}: {e}")
+            return False
+        if self.cache is not None:
+            with open(os.path.join(self.save_folder, filename), 'rb') as f:
+                self.cache.put_records({cid: f.read()}, self.file_type)
+        return True
+
+    def download_batch(self, cids):
+        """Fetch the records of several CIDs; returns {cid: saved}.
+
+        SDF and JSON records come from one POST whose combined response is
+        split locally. CIDs missing from it, and every CID in other formats,
+        are downloaded one by one so their errors are logged as single
+        downloads log them (the format 'Retry Failed Downloads' reads).
+        Cached records are written without a request.
+        """
+        cached = self.cache.get_records(cids, self.file_type) if self.cache is not None else {}
+        results = {}
+        for cid, data in cached.items():
+            self.write_record(cid, [data])
+            results[cid] = True
+        cids = [cid for cid in cids if cid not in cached]
+        if self.offline:
+            for cid in cids:
+                self.log_error(f"Failed to download {cid}.{self.file_type}: not in cache (offline)")
+                results[cid] = False
+            return results
+        records = {}
+        if self.file_type in BATCHED_TYPES and len(cids) > 1:
+            url = f"{PUG_REST}/compound/cid/record/{self.file_type}?record_type=3d"
+            try:
+                with self.limiter.request(self.session.post, url, data={"cid": ",".join(cids)}) as response:
+                    if response.status_code == 200:
+                        records = split_records(response.content, self.file_type)
+            except (requests.RequestException, ValueError, KeyError):
+                records = {}
+        if records and self.cache is not None:
+            self.cache.put_records({cid: records[cid] for cid in cids if cid in records}, self.file_type)
+        for cid in cids:
+            if cid in records:
+                self.write_record(cid, [records[cid]])
+                results[cid] = True
+            else:
+                results[cid] = self.download_record(cid)
+        return results
+
+    def close(self):
+        self.session.close()
+
+def retryable_cids(lines):
+    """CIDs of the record downloads in download_errors.log lines that are worth retrying."""
+    return [match.group(1) for match in map(RETRYABLE_ERROR.match, lines) if match]
+
+def iter_names(path):
+    """Compound names (or CIDs) from a text file, one per line, read lazily."""
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+async def download_names(names, save_folder, file_type, is_retry=False, on_progress=None, max_in_flight=MAX_CONCURRENT_REQUESTS * 2,
+                         cache=None, offline=OFFLINE):
+    """Download the records of every name (or CID, with is_retry) in an iterable.
+
+    Names are pulled from the iterable only as slots free up, with at most
+    max_in_flight lookups or record requests running. CIDs are gathered into
+    batches as they resolve, so record downloads start long before the list
+    is exhausted. on_progress(done, downloaded, errors) is called as each name
+    completes. cache defaults to the shared PubchemCache; pass False to
+    bypass it. Returns (downloaded, errors).
+    """
+    own_cache = cache is None
+    if own_cache:
+        cache = PubchemCache()
+    downloader = Downloader(save_folder, file_type, cache=cache or None, offline=offline)
+    # requests is blocking, so each request runs on a worker thread; one per slot
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    loop = asyncio.get_running_loop()
+    batch_size = RECORD_BATCH_SIZE if file_type in BATCHED_TYPES else 1
+    counts = {"done": 0, "downloaded": 0, "errors": 0}
+    cid_status = {}  # cid -> whether its record was saved
+    waiting = {}     # cid -> number of names waiting for its record
+    batch = []
+    tasks = set()
+    slots = asyncio.Semaphore(max_in_flight)
+
+    def complete(ok, names=1):
+        counts["done"] += names
+        counts["downloaded" if ok else "errors"] += names
+        if on_progress is not None:
+            on_progress(counts["done"], counts["downloaded"], counts["errors"])
+
+    def spawn(coroutine):
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def fetch(cids):
+        try:
+            results = await loop.run_in_executor(executor, downloader.download_batch, cids)
+        except Exception as e:
+            downloader.log_error(f"Failed to download records for CIDs {','.join(cids)}: {e}")
+            results = {}
+        finally:
+            slots.release()
+        for cid in cids:
+            cid_status[cid] = results.get(cid, False)
+            complete(cid_status[cid], waiting.pop(cid, 0))
+
+    async def flush():
+        if batch:
+            cids = batch[:]
+            batch.clear()
+            await slots.acquire()
+            spawn(fetch(cids))
+
+    async def queue_cid(cid):
+        if cid in cid_status:
+            complete(cid_status[cid])  # another name already fetched this compound
+        elif cid in waiting:
+            waiting[cid] += 1
+        else:
+            waiting[cid] = 1
+            batch.append(cid)
+            if len(batch) >= batch_size:
+                await flush()
+
+    async def resolve(name, cid_file):
+        try:
+            cid = await loop.run_in_executor(executor, downloader.resolve_name, name)
+        except Exception as e:
+            downloader.log_error(f"Failed to download {file_type} file for {name}: {e}")
+            cid = None
+        finally:
+            slots.release()
+        if cid is None:
+            complete(False)
+            return
+        cid_file.write(f"{cid}\n")
+        await queue_cid(str(cid))
+
+    cid_list = nullcontext() if is_retry else open(os.path.join(save_folder, CID_LIST), 'w')
+    try:
+        with cid_list as cid_file:
+            for name in names:
+                name = name.strip()  # Remove leading/trailing whitespace and newline characters
+                if not name:
+                    continue
+                if is_retry:
+                    await queue_cid(name)
+                else:
+                    await slots.acquire()
+                    spawn(resolve(name, cid_file))
+            while True:
+                await flush()  # the last CIDs may not fill a batch
+                if not tasks:
+                    break
+                await asyncio.gather(*list(tasks))
+    finally:
+        executor.shutdown()
+        downloader.close()
+        if own_cache:
+            cache.close()
+    return counts["downloaded"], counts["errors"]
+
+def download(names, save_folder, file_type, is_retry=False, on_progress=None, cache=None, offline=OFFLINE):
+    """Run download_names to completion from synchronous code (a QThread or the command line)."""
+    return asyncio.run(download_names(names, save_folder, file_type, is_retry, on_progress, cache=cache, offline=offline))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download 3D records from PubChem for a list of compound names or CIDs")
+    parser.add_argument("names", help="text file with one compound name (or CID with --cids) per line")
+    parser.add_argument("save_folder")
+    parser.add_argument("--format", choices=["sdf", "json", "xml", "asnt"], default="sdf")
+    parser.add_argument("--cids", action="store_true", help="the list holds CIDs, e.g. to retry failed downloads")
+    parser.add_argument("--offline", action="store_true", default=OFFLINE, help="serve everything from the local cache, without requests")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor fill the local cache")
+    parser.add_argument("--cache-ttl", type=float, default=TTL_DAYS, help="days before a cached lookup or record is fetched again")
+    parser.add_argument("--cache-size", type=float, default=MAX_CACHE_BYTES / 1024 ** 2, help="cache size limit in MB")
+    args = parser.parse_args(argv)
+    if args.offline and args.no_cache:
+        parser.error("--offline needs the cache")
+    os.makedirs(args.save_folder, exist_ok=True)
+    cache = False if args.no_cache else PubchemCache(ttl_days=args.cache_ttl, max_bytes=int(args.cache_size * 1024 ** 2))
+    with tqdm(desc="Downloading compounds", unit=" compounds") as progress:
+        def on_progress(done, downloaded, errors):
+            progress.update(done - progress.n)
+            progress.set_postfix(downloaded=downloaded, errors=errors)
+        try:
+            downloaded, errors = download(iter_names(args.names), args.save_folder, args.format, args.cids, on_progress, cache, args.offline)
+        finally:
+            if cache:
+                cache.close()
+    print(f"Download finished with {downloaded} successful downloads and {errors} errors.")
+    return 0 if errors == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+CACHE_DIR = os.environ.get("RESHELP_PUBCHEM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "reshelp", "pubchem"))
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+TTL_DAYS = 30
+NOT_FOUND_TTL_DAYS = 1  # names PubChem did not know are asked again sooner
+
+class PubchemCache:
+    """Local store of PubChem name -> CID lookups and CID -> record bytes per format.
+
+    Everything lives in one SQLite file under CACHE_DIR. Entries older than
+    ttl_days count as missing, and once the records exceed max_bytes the least
+    recently used ones are evicted. Record bytes are kept in their own table
+    and the byte total in a counter, so expiry and eviction only read the small
+    metadata rows. Safe to share between download threads.
+    """
+
+    def __init__(self, root=CACHE_DIR, ttl_days=TTL_DAYS, max_bytes=MAX_CACHE_BYTES):
+        os.makedirs(root, exist_ok=True)
+        self.ttl = ttl_days * 86400
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, "pubchem.sqlite"), timeout=60, check_same_thread=False)
+        if "data" in [column[1] for column in self.db.execute("PRAGMA table_info(records)")]:
+            self.db.execute("DROP TABLE records")  # early layout with the bytes inline; it is only a cache
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, cid INTEGER, fetched REAL);
+            CREATE TABLE IF NOT EXISTS records (cid TEXT, format TEXT, size INTEGER, fetched REAL, last_used REAL,
+                                                PRIMARY KEY (cid, format));
+            CREATE TABLE IF NOT EXISTS record_data (cid TEXT, format TEXT, data BLOB, PRIMARY KEY (cid, format));
+            CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER);
+            CREATE INDEX IF NOT EXISTS names_fetched ON names (fetched);
+            CREATE INDEX IF NOT EXISTS records_fetched ON records (fetched);
+            CREATE INDEX IF NOT EXISTS records_last_used ON records (last_used);
+            INSERT OR IGNORE INTO totals VALUES ('bytes', (SELECT COALESCE(SUM(size), 0) FROM records));
+        """)
+        self.db.commit()
+
+    def get_cid(self, name):
+        """(found, cid) for a name: found is False on a miss; cid is None if PubChem had no match."""
+        with self.lock:
+            row = self.db.execute("SELECT cid, fetched FROM names WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return False, None
+        cid, fetched = row
+        ttl = self.ttl if cid is not None else min(self.ttl, NOT_FOUND_TTL_DAYS * 86400)
+        if time.time() - fetched > ttl:
+            return False, None
+        return True, cid
+
+    def put_cid(self, name, cid):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO names VALUES (?, ?, ?)", (name, cid, time.time()))
+            self.db.commit()
+
+    def get_records(self, cids, file_type):
+        """{cid: record bytes} for the CIDs cached in file_type and not expired; marks them used."""
+        now = time.time()
+        found = {}
+        with self.lock:
+            for cid in cids:
+                row = self.db.execute("SELECT fetched FROM records WHERE cid = ? AND format = ?", (str(cid), file_type)).fetchone()
+                if row is None or now - row[0] > self.ttl:
+                    continue
+                data = self.db.execute("SELECT data FROM record_data WHERE cid = ? AND format = ?", (str(cid), file_type)).fetchone()
+                if data is not None:
+                    found[str(cid)] = data[0]
+            self.db.executemany("UPDATE records SET last_used = ? WHERE cid = ? AND format = ?", [(now, cid, file_type) for cid in found])
+            self.db.commit()
+        return found
+
+    def put_records(self, records, file_type):
+        """Store {cid: record bytes} in one transaction, then evict down to max_bytes."""
+        now = time.time()
+        with self.lock:
+            added = 0
+            for cid, data in records.items():
+                old = self.db.execute("SELECT size FROM records WHERE cid = ? AND format = ?", (str(cid), file_type)).fetchone()
+                added += len(data) - (old[0] if old else 0)
+                self.db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)", (str(cid), file_type, len(data), now, now))
+                self.db.execute("INSERT OR REPLACE INTO record_data VALUES (?, ?, ?)", (str(cid), file_type, data))
+            self.db.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'", (added,))
+            self.evict()
+
+    def remove_records(self, keys):
+        """Delete (cid, format, size) records and take their size off the byte total."""
+        for cid, file_type, _ in keys:
+            self.db.execute("DELETE FROM records WHERE cid = ? AND format = ?", (cid, file_type))
+            self.db.execute("DELETE FROM record_data WHERE cid = ? AND format = ?", (cid, file_type))
+        self.db.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (sum(size for _, _, size in keys),))
+
+    def evict(self):
+        """Drop expired entries, then least recently used records until under max_bytes. Call with the lock held."""
+        cutoff = time.time() - self.ttl
+        self.remove_records(self.db.execute("SELECT cid, format, size FROM records WHERE fetched < ?", (cutoff,)).fetchall())
+        self.db.execute("DELETE FROM names WHERE fetched < ?", (cutoff,))
+        total = self.db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+        if total > self.max_bytes:
+            victims = []
+            for cid, file_type, size in self.db.execute("SELECT cid, format, size FROM records ORDER BY last_used"):
+                victims.append((cid, file_type, size))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            self.remove_records(victims)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
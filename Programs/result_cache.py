@@ -0,0 +1,131 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from job_ledger import file_digest
+
+CACHE_DIR = os.environ.get("RESHELP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "reshelp", "docking"))
+MAX_CACHE_BYTES = 5 * 1024 ** 3
+
+# conf.txt options that only say where things are or how fast to run; every other option is part of the key
+IGNORED_OPTIONS = {"cpu", "out", "log", "dir", "receptor", "ligand"}
+# Vina's defaults, so leaving an option out and writing its default give the same key
+DEFAULT_OPTIONS = {
+    "exhaustiveness": "8", "num_modes": "9", "energy_range": "3",
+    "scoring": "vina", "spacing": "0.375", "min_rmsd": "1",
+}
+
+def normalize_options(options):
+    """Reduce conf.txt options to the ones that change the result, in a canonical text form.
+
+    A flex= file is replaced by the digest of its contents.
+    """
+    options = dict(DEFAULT_OPTIONS, **{key: value for key, value in options.items() if key not in IGNORED_OPTIONS})
+    normalized = []
+    for key, value in sorted(options.items()):
+        if key == "flex" and value:
+            value = file_digest(value)
+        elif value is not None:
+            try:
+                value = repr(float(value))
+            except ValueError:
+                pass
+        normalized.append(f"{key}={value}")
+    return ';'.join(normalized)
+
+def result_key(receptor_digest, ligand_digest, options, vina_version=""):
+    """Content address of one docking result by the given Vina version."""
+    text = f"{receptor_digest}|{ligand_digest}|{normalize_options(options)}|{vina_version}"
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ResultCache:
+    """Local cache of Vina logs and output poses shared by every working directory.
+
+    Results live under CACHE_DIR as <key>.log / <key>.pdbqt files; a small SQLite
+    index tracks their size and last use so the cache stays under max_bytes by
+    evicting the least recently used entries.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=60, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self.db.commit()
+
+    def paths(self, key):
+        folder = os.path.join(self.root, key[:2])
+        return os.path.join(folder, key + ".log"), os.path.join(folder, key + ".pdbqt")
+
+    def get(self, key, pose_dest):
+        """Copy a cached pose to pose_dest and return the cached log text, or None on a miss."""
+        log_file, pose_file = self.paths(key)
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is None:
+                return None
+            try:
+                with open(log_file, 'r') as f:
+                    log = f.read()
+                shutil.copyfile(pose_file, pose_dest)
+            except OSError:
+                self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+        return log
+
+    def put(self, key, log, pose_src):
+        """Store a finished result, then evict old entries if the cache is over its size cap."""
+        log_file, pose_file = self.paths(key)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        tmp_suffix = f".tmp{os.getpid()}.{threading.get_ident()}"
+        with open(log_file + tmp_suffix, 'w') as f:
+            f.write(log)
+        shutil.copyfile(pose_src, pose_file + tmp_suffix)
+        os.replace(log_file + tmp_suffix, log_file)
+        os.replace(pose_file + tmp_suffix, pose_file)
+        size = os.path.getsize(log_file) + os.path.getsize(pose_file)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, size, time.time()))
+            self.db.commit()
+            self.evict()
+
+    def evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            for path in self.paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
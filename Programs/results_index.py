@@ -0,0 +1,109 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sqlite3
+from tqdm import tqdm
+import vinalog
+
+INDEX_FILE = "results_index.sqlite"
+
+class ResultsIndex:
+    """Parsed Vina results of one log directory, kept in <log_dir>/results_index.sqlite.
+
+    Each log is keyed by its file name, size and mtime; update() only parses
+    logs that are new or changed since the last run and forgets deleted ones.
+    Rankings are then answered from the index instead of the log files.
+    """
+
+    def __init__(self, log_dir, index_file=INDEX_FILE):
+        self.log_dir = log_dir
+        self.db = sqlite3.connect(os.path.join(log_dir, index_file), timeout=60)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS logs (name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, cid TEXT, best REAL);
+            CREATE TABLE IF NOT EXISTS modes (name TEXT, mode INTEGER, affinity REAL, rmsd_lb REAL, rmsd_ub REAL,
+                                              PRIMARY KEY (name, mode));
+            CREATE INDEX IF NOT EXISTS logs_best ON logs (best);
+            CREATE INDEX IF NOT EXISTS logs_cid ON logs (cid);
+        """)
+        self.db.commit()
+
+    def changed_logs(self):
+        """(name, path, size, mtime) of new or modified logs, plus the names of deleted ones."""
+        known = {name: (size, mtime) for name, size, mtime in self.db.execute("SELECT name, size, mtime FROM logs")}
+        changed = []
+        with os.scandir(self.log_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(vinalog.LOG_SUFFIX) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if known.pop(entry.name, None) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+        return changed, list(known)
+
+    def update(self, jobs=None, chunk_size=vinalog.CHUNK_SIZE):
+        """Bring the index up to date with the log directory; returns the number of logs parsed."""
+        changed, deleted = self.changed_logs()
+        for name in deleted:
+            self.forget(name)
+        if deleted:
+            print(f"Removed {len(deleted)} deleted logs from the index")
+        if not changed:
+            self.db.commit()
+            return 0
+        stats = {name: (size, mtime) for name, _, size, mtime in changed}
+        def on_error(log_file, message):
+            print(f"Error reading file {os.path.basename(log_file)}: {message}")  # not indexed, so it is retried next time
+        with tqdm(total=len(changed), desc="Indexing new log files", unit=" files") as progress:
+            # logs without a mode table are indexed too (best None) so they are not parsed again
+            for count, results in vinalog.parse_logs([path for _, path, _, _ in changed], jobs, chunk_size, full_table=True,
+                                                     on_error=on_error, keep_empty=True, key=os.path.basename):
+                for name, rows in results:
+                    self.store(name, *stats[name], rows)
+                self.db.commit()
+                progress.update(count)
+        return len(changed)
+
+    def store(self, name, size, mtime, rows):
+        self.forget(name)
+        best = rows[0][1] if rows else None
+        self.db.execute("INSERT INTO logs VALUES (?, ?, ?, ?, ?)", (name, size, mtime, vinalog.cid_from_log(name), best))
+        self.db.executemany("INSERT INTO modes VALUES (?, ?, ?, ?, ?)", [(name,) + row for row in rows])
+
+    def forget(self, name):
+        self.db.execute("DELETE FROM logs WHERE name = ?", (name,))
+        self.db.execute("DELETE FROM modes WHERE name = ?", (name,))
+
+    def ranking(self, limit=None):
+        """(cid, best affinity) of every docked ligand, best first."""
+        query = "SELECT cid, best FROM logs WHERE best IS NOT NULL ORDER BY best"
+        if limit is not None:
+            return self.db.execute(query + " LIMIT ?", (limit,)).fetchall()
+        return self.db.execute(query).fetchall()
+
+    def below(self, cutoff):
+        """(cid, best affinity) of the ligands scoring at or below cutoff kcal/mol, best first."""
+        return self.db.execute("SELECT cid, best FROM logs WHERE best <= ? ORDER BY best", (cutoff,)).fetchall()
+
+    def poses(self, cid):
+        """The full (mode, affinity, rmsd l.b., rmsd u.b.) table of one ligand."""
+        return self.db.execute("SELECT mode, affinity, rmsd_lb, rmsd_ub FROM modes JOIN logs USING (name) "
+                               "WHERE cid = ? ORDER BY mode", (cid,)).fetchall()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
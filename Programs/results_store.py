@@ -0,0 +1,191 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Columnar store of every docking pose: one row per (receptor, ligand, mode)
+with affinity and RMSD bounds in NumPy arrays, saved as a compressed .npz.
+Ranking and statistics run as array operations over all poses at once.
+
+    python3 Programs/results_store.py build Log results.npz [receptor]
+    python3 Programs/results_store.py top results.npz 100
+    python3 Programs/results_store.py stats results.npz
+"""
+
+import os
+import sys
+import numpy as np
+from results_index import ResultsIndex
+
+STORE_FILE = "results.npz"
+COLUMNS = ("ligand", "receptor", "mode", "affinity", "rmsd_lb", "rmsd_ub")
+
+class ResultsStore:
+    """Pose table in columns; ligand and receptor columns index into the sorted cids and receptors arrays."""
+
+    def __init__(self, cids, receptors, ligand, receptor, mode, affinity, rmsd_lb, rmsd_ub):
+        self.cids = np.asarray(cids, dtype=str)
+        self.receptors = np.asarray(receptors, dtype=str)
+        self.ligand = np.asarray(ligand, dtype=np.int32)
+        self.receptor = np.asarray(receptor, dtype=np.int16)
+        self.mode = np.asarray(mode, dtype=np.int16)
+        self.affinity = np.asarray(affinity, dtype=np.float32)
+        self.rmsd_lb = np.asarray(rmsd_lb, dtype=np.float32)
+        self.rmsd_ub = np.asarray(rmsd_ub, dtype=np.float32)
+        self.best_cache = {}
+
+    def __len__(self):
+        return len(self.affinity)
+
+    @classmethod
+    def from_tables(cls, tables, receptor_name=""):
+        """Build from (cid, [(mode, affinity, rmsd l.b., rmsd u.b.), ...]) pairs."""
+        cids, ligand, rows = [], [], []
+        for cid, table in tables:
+            ligand.extend([len(cids)] * len(table))
+            cids.append(cid)
+            rows.extend(table)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        cids, inverse = np.unique(np.asarray(cids, dtype=str), return_inverse=True)
+        ligand = inverse[np.asarray(ligand, dtype=np.int64)] if ligand else np.zeros(0, dtype=np.int32)
+        return cls(cids, [receptor_name], ligand, np.zeros(len(rows)), rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3])
+
+    @classmethod
+    def from_log_dir(cls, log_dir, receptor_name="", jobs=None):
+        """Build from the results index of a log directory, updating the index first."""
+        index = ResultsIndex(log_dir)
+        try:
+            index.update(jobs)
+            query = index.db.execute("SELECT cid, mode, affinity, rmsd_lb, rmsd_ub FROM modes JOIN logs USING (name) ORDER BY name, mode")
+            tables = {}
+            for cid, *row in query:
+                tables.setdefault(cid, []).append(tuple(row))
+        finally:
+            index.close()
+        return cls.from_tables(tables.items(), receptor_name)
+
+    @classmethod
+    def concat(cls, stores):
+        """One store holding the poses of several (e.g. per-receptor) stores."""
+        cids = np.unique(np.concatenate([store.cids for store in stores]))
+        receptors = np.unique(np.concatenate([store.receptors for store in stores]))
+        columns = {name: [] for name in COLUMNS}
+        for store in stores:
+            columns["ligand"].append(np.searchsorted(cids, store.cids)[store.ligand])
+            columns["receptor"].append(np.searchsorted(receptors, store.receptors)[store.receptor])
+            for name in COLUMNS[2:]:
+                columns[name].append(getattr(store, name))
+        return cls(cids, receptors, *(np.concatenate(columns[name]) for name in COLUMNS))
+
+    def save(self, path=STORE_FILE):
+        np.savez_compressed(path, cids=self.cids, receptors=self.receptors,
+                            **{name: getattr(self, name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, path=STORE_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["cids"], data["receptors"], *(data[name] for name in COLUMNS))
+
+    def receptor_index(self, receptor):
+        position = np.searchsorted(self.receptors, receptor)
+        if position >= len(self.receptors) or self.receptors[position] != receptor:
+            raise ValueError(f"No results for receptor {receptor}")
+        return position
+
+    def best_poses(self, receptor=None):
+        """Row indices of the best pose of every ligand (per receptor), grouped by receptor and ligand."""
+        if receptor in self.best_cache:
+            return self.best_cache[receptor]
+        rows = np.arange(len(self))
+        if receptor is not None:
+            rows = rows[self.receptor == self.receptor_index(receptor)]
+        if len(rows) == 0:
+            return rows
+        # group rows by (receptor, ligand); a stable sort is nearly free on the usual grouped layout
+        keys = self.receptor[rows].astype(np.int64) * len(self.cids) + self.ligand[rows]
+        order = rows[np.argsort(keys, kind="stable")]
+        keys = self.receptor[order].astype(np.int64) * len(self.cids) + self.ligand[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        values = self.affinity[order]
+        best = np.minimum.reduceat(values, starts)
+        candidates = np.flatnonzero(values == np.repeat(best, np.diff(np.r_[starts, len(order)])))
+        group = np.searchsorted(starts, candidates, side="right") - 1
+        result = order[candidates[np.r_[True, group[1:] != group[:-1]]]]
+        self.best_cache[receptor] = result
+        return result
+
+    def top_k(self, k, receptor=None):
+        """(cid, receptor, affinity) of the k best ligand poses, best first."""
+        best = self.best_poses(receptor)
+        if k < len(best):
+            best = best[np.argpartition(self.affinity[best], k)[:k]]
+        best = best[np.argsort(self.affinity[best], kind="stable")]
+        return list(zip(self.cids[self.ligand[best]], self.receptors[self.receptor[best]], self.affinity[best].tolist()))
+
+    def percentiles(self, q=(1, 5, 25, 50, 75, 95, 99), receptor=None):
+        """Percentiles of the best affinity per ligand; NaN for each when there are no results."""
+        best = self.best_poses(receptor)
+        if len(best) == 0:
+            return dict.fromkeys(q, float("nan"))
+        return dict(zip(q, np.percentile(self.affinity[best], q).tolist()))
+
+    def zscores(self):
+        """Best affinity per (receptor, ligand) standardized within each receptor.
+
+        Returns (ligand index, receptor index, z-score) arrays, so scores from
+        receptors with different affinity scales can be compared.
+        """
+        best = self.best_poses()
+        groups = self.receptor[best]
+        values = self.affinity[best].astype(np.float64)
+        counts = np.bincount(groups, minlength=len(self.receptors))
+        means = np.bincount(groups, values, len(self.receptors)) / np.maximum(counts, 1)
+        variances = np.bincount(groups, (values - means[groups]) ** 2, len(self.receptors)) / np.maximum(counts, 1)
+        stds = np.sqrt(variances)
+        z = (values - means[groups]) / np.where(stds > 0, stds, 1)[groups]
+        return self.ligand[best], groups, z
+
+    def join(self, cid_list, receptor=None):
+        """Best affinity of each CID in cid_list, NaN where it was not docked."""
+        best = self.best_poses(receptor)
+        per_ligand = np.full(len(self.cids), np.nan, dtype=np.float32)
+        np.fmin.at(per_ligand, self.ligand[best], self.affinity[best])
+        cid_list = np.asarray(cid_list, dtype=str)
+        if len(self.cids) == 0:
+            return np.full(len(cid_list), np.nan, dtype=np.float32)
+        position = np.minimum(np.searchsorted(self.cids, cid_list), len(self.cids) - 1)
+        return np.where(self.cids[position] == cid_list, per_ligand[position], np.nan)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) >= 2 and argv[0] == "build":
+        store = ResultsStore.from_log_dir(argv[1], argv[3] if len(argv) > 3 else os.path.basename(os.path.abspath(argv[1])))
+        output = argv[2] if len(argv) > 2 else os.path.join(argv[1], STORE_FILE)
+        store.save(output)
+        print(f"Saved {len(store)} poses of {len(store.cids)} ligands to {output}")
+    elif len(argv) >= 2 and argv[0] == "top":
+        for cid, receptor, affinity in ResultsStore.load(argv[1]).top_k(int(argv[2]) if len(argv) > 2 else 100):
+            print(f"{cid}\t{receptor}\t{affinity:.1f}")
+    elif len(argv) >= 2 and argv[0] == "stats":
+        store = ResultsStore.load(argv[1])
+        print(f"{len(store)} poses, {len(store.cids)} ligands, {len(store.receptors)} receptors")
+        for receptor in store.receptors:
+            print(receptor, {q: round(value, 2) for q, value in store.percentiles(receptor=receptor).items()})
+    else:
+        print("Usage: python3 Programs/results_store.py build <log dir> [output.npz] [receptor] | top <store.npz> [k] | stats <store.npz>")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
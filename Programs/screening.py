@@ -0,0 +1,185 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import vina_engine
+import dataan
+from workers import default_jobs, imap_bounded
+from job_ledger import JobLedger, DONE, FAILED, file_digest
+from result_cache import result_key
+
+TIER1_DIR = "Tier1"
+TIER1_EXHAUSTIVENESS = 1
+TIERED_RESULTS = "tiered_results.txt"
+ENSEMBLE_DIR = "Ensemble"
+RECEPTOR_LIST = "receptors.txt"
+
+def first_mode_affinities(ligands, output_dir=None):
+    """Map each ligand to the first-mode affinity in its log, skipping ligands without one."""
+    affinities = {}
+    for ligand in ligands:
+        log_file = vina_engine.log_path(ligand, output_dir)
+        try:
+            result = dataan.parse_log_file(log_file)
+        except OSError:
+            continue
+        if result is not None:
+            affinities[ligand] = result[1]
+    return affinities
+
+def select_top(affinities, top_k=None, top_percent=None):
+    """The best-scoring ligands by top_k count or top_percent of the screened set."""
+    ranked = sorted(affinities, key=affinities.get)
+    if top_k is None:
+        top_k = math.ceil(len(ranked) * (top_percent or 1) / 100)
+    return ranked[:top_k]
+
+def write_tiered_results(tier1, tier2, output_file=TIERED_RESULTS):
+    """Write the final ranking: re-docked ligands by their full-exhaustiveness score, then the rest by tier 1."""
+    col_widths = [30, 20, 6]
+    rows = [(ligand, tier2[ligand], 2) for ligand in sorted(tier2, key=tier2.get)]
+    rows += [(ligand, tier1[ligand], 1) for ligand in sorted(tier1, key=tier1.get) if ligand not in tier2]
+    with open(output_file, 'w') as f:
+        f.write(' | '.join(str(item).ljust(width) for item, width in zip(["Ligand", "Affinity (kcal/mol)", "Tier"], col_widths)) + '\n')
+        f.write('=' * 62 + '\n')
+        for row in rows:
+            f.write(' | '.join(str(item).ljust(width) for item, width in zip(row, col_widths)) + '\n')
+    print("Tiered results written to", output_file)
+
+def tiered_screen(ligands, conf_file=vina_engine.CONF_FILE, top_k=None, top_percent=1.0,
+                  fast_exhaustiveness=TIER1_EXHAUSTIVENESS, **dock_options):
+    """Screen everything with a cheap search, then re-dock only the best ligands properly.
+
+    Tier 1 docks every ligand at fast_exhaustiveness into Tier1/ with its own
+    ledger. The top_k (or top_percent) ligands by first-mode affinity are then
+    re-docked at the exhaustiveness from conf_file into the usual layout, also
+    tracked by the main ledger. Returns (tier 1 affinities, tier 2 affinities).
+    """
+    os.makedirs(TIER1_DIR, exist_ok=True)
+    tier1_ledger = JobLedger(os.path.join(TIER1_DIR, "docking_ledger.jsonl"))
+    try:
+        print(f"Tier 1: docking {len(ligands)} ligands at exhaustiveness {fast_exhaustiveness}")
+        vina_engine.dock_ligands(ligands, conf_file, master_log=os.path.join(TIER1_DIR, vina_engine.MASTER_LOG),
+                                 ledger=tier1_ledger, output_dir=TIER1_DIR,
+                                 overrides={"exhaustiveness": fast_exhaustiveness}, **dock_options)
+    finally:
+        tier1_ledger.close()
+    tier1 = first_mode_affinities(ligands, TIER1_DIR)
+
+    top = select_top(tier1, top_k, top_percent)
+    tier2_ledger = JobLedger()
+    try:
+        print(f"Tier 2: re-docking the best {len(top)} ligands at full exhaustiveness")
+        vina_engine.dock_ligands(top, conf_file, ledger=tier2_ledger, **dock_options)
+    finally:
+        tier2_ledger.close()
+    tier2 = first_mode_affinities(top)
+    write_tiered_results(tier1, tier2)
+    return tier1, tier2
+
+def read_receptor_list(receptor_file=RECEPTOR_LIST):
+    """Read receptors.txt: one 'name receptor.pdbqt conf.txt' line per receptor conformer."""
+    receptors = []
+    with open(receptor_file, 'r') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise ValueError(f"Expected 'name receptor conf' in {receptor_file}, got: {line.strip()}")
+            receptors.append({"name": fields[0], "receptor": fields[1], "conf": fields[2]})
+    return receptors
+
+def write_matrix_results(affinities, receptors, output_file):
+    """Write one row per ligand with its best affinity against each receptor and overall."""
+    names = [receptor["name"] for receptor in receptors]
+    col_widths = [30] + [max(12, len(name)) for name in names] + [12]
+    rows = []
+    for ligand, scores in affinities.items():
+        best = min(scores.values())
+        rows.append([ligand] + [scores.get(name, '-') for name in names] + [best])
+    rows.sort(key=lambda row: row[-1])
+    with open(output_file, 'w') as f:
+        f.write(' | '.join(str(item).ljust(width) for item, width in zip(["Ligand"] + names + ["Best"], col_widths)) + '\n')
+        f.write('=' * (sum(col_widths) + 3 * len(names) + 3) + '\n')
+        for row in rows:
+            f.write(' | '.join(str(item).ljust(width) for item, width in zip(row, col_widths)) + '\n')
+    print("Ensemble results written to", output_file)
+
+def dock_matrix(ligands, receptors, jobs=None, total_cpu=None, cache=None, output_dir=ENSEMBLE_DIR):
+    """Dock every ligand against every receptor conformer from one shared work queue.
+
+    Each receptor brings its own conf.txt (box); the prepared ligand files are
+    shared by all receptors. All receptor-ligand pairs go through a single pool,
+    so no core waits at a per-receptor barrier. Results land in
+    output_dir/<receptor name>/ in the usual per-ligand layout, progress is kept
+    in output_dir/docking_ledger.jsonl and a ligand x receptor table is written
+    to output_dir/ensemble_results.txt.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs, cpu_per_job = vina_engine.split_cpu_budget(total_cpu or default_jobs(), jobs)
+    ligand_digests = {ligand: file_digest(ligand) for ligand in ligands}
+    for receptor in receptors:
+        receptor["folder"] = os.path.join(output_dir, receptor["name"])
+        receptor["options"] = dict(vina_engine.read_conf(receptor["conf"]), receptor=receptor["receptor"])
+        receptor["digests"] = {"receptor": file_digest(receptor["receptor"]), "conf": file_digest(receptor["conf"])}
+        os.makedirs(receptor["folder"], exist_ok=True)
+
+    def inputs(receptor, ligand):
+        return dict(receptor["digests"], ligand=ligand_digests[ligand])
+
+    ledger = JobLedger(os.path.join(output_dir, "docking_ledger.jsonl"))
+    pairs = [(receptor, ligand) for ligand in ligands for receptor in receptors
+             if ledger.needs_docking(f"{receptor['name']}/{ligand}", inputs(receptor, ligand))]
+    print(f"Docking {len(pairs)} receptor-ligand pairs with {jobs} parallel Vina jobs, {cpu_per_job} CPU each")
+
+    def dock(pair):
+        receptor, ligand = pair
+        key = result_key(receptor["digests"]["receptor"], ligand_digests[ligand], receptor["options"], vina_engine.vina_version())
+        pose_file = vina_engine.out_path(ligand, receptor["folder"])
+        os.makedirs(os.path.dirname(pose_file), exist_ok=True)
+        output = cache.get(key, pose_file) if cache is not None else None
+        if output is not None:
+            vina_engine.write_atomic(vina_engine.log_path(ligand, receptor["folder"]), output)
+            return 0, output
+        returncode, output = vina_engine.run_vina(ligand, receptor["conf"], cpu_per_job, receptor["folder"],
+                                                  {"receptor": receptor["receptor"]})
+        if cache is not None and returncode == 0 and os.path.exists(pose_file):
+            cache.put(key, output, pose_file)
+        return returncode, output
+
+    master_logs = {receptor["name"]: open(os.path.join(receptor["folder"], vina_engine.MASTER_LOG), 'a') for receptor in receptors}
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for (receptor, ligand), future in tqdm(imap_bounded(executor, dock, pairs, jobs * 2), total=len(pairs), desc="Ensemble docking"):
+                returncode, output = future.result()
+                master_logs[receptor["name"]].write(vina_engine.master_log_entry(ligand, output))
+                ledger.mark(f"{receptor['name']}/{ligand}", DONE if returncode == 0 else FAILED, inputs(receptor, ligand))
+    finally:
+        for master in master_logs.values():
+            master.close()
+        ledger.close()
+
+    affinities = {}
+    for receptor in receptors:
+        for ligand, affinity in first_mode_affinities(ligands, receptor["folder"]).items():
+            affinities.setdefault(ligand, {})[receptor["name"]] = affinity
+    write_matrix_results(affinities, receptors, os.path.join(output_dir, "ensemble_results.txt"))
+    return affinities
@@ -0,0 +1,386 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import functools
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from workers import default_jobs, imap_bounded
+from job_ledger import DONE, FAILED, PENDING, RUNNING, file_digest
+from result_cache import result_key
+
+VINA = "vina"
+CONF_FILE = "conf.txt"
+LIGAND_LIST = "ligands.txt"
+MASTER_LOG = "master_log.log"
+CPU_PER_JOB = 4  # Vina's own threading stops paying off beyond a few cores
+
+def read_conf(conf_file=CONF_FILE):
+    """Read a Vina config file into a dict of option name -> value (both strings)."""
+    options = {}
+    with open(conf_file, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            options[key.strip()] = value.strip()
+    return options
+
+def read_ligand_list(ligand_file=LIGAND_LIST):
+    """Return the ligand paths listed in ligand_file, one per line."""
+    with open(ligand_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def split_cpu_budget(total_cpu, jobs=None):
+    """Split total_cpu cores into (jobs, cpu_per_job) for concurrent Vina processes."""
+    total_cpu = max(1, int(total_cpu))
+    if not jobs:
+        jobs = max(1, total_cpu // CPU_PER_JOB)
+    jobs = max(1, min(int(jobs), total_cpu))
+    return jobs, max(1, total_cpu // jobs)
+
+def log_path(ligand, output_dir=None):
+    """Per-ligand log file name, as vina_modified.pl wrote it, optionally under output_dir."""
+    return os.path.join(output_dir or '', f"{ligand}_log.log")
+
+def out_path(ligand, output_dir=None):
+    """Pose file Vina writes for a ligand when no --out is given, optionally under output_dir."""
+    return os.path.join(output_dir or '', f"{os.path.splitext(ligand)[0]}_out.pdbqt")
+
+def option_args(overrides):
+    """Turn {option: value} overrides of conf.txt into Vina command line arguments."""
+    args = []
+    for key, value in (overrides or {}).items():
+        args += [f"--{key}", str(value)]
+    return args
+
+def write_atomic(path, text):
+    """Write text to path via a temporary file so readers never see a partial file."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def run_vina(ligand, conf_file=CONF_FILE, cpu=None, output_dir=None, overrides=None):
+    """Dock one ligand and write its log. Returns (return code, Vina output).
+
+    overrides replace conf.txt options on the command line; with output_dir the
+    log and poses go under that folder instead of next to the ligand.
+    """
+    command = [VINA, "--config", conf_file, "--ligand", ligand]
+    if cpu:
+        command += ["--cpu", str(cpu)]
+    command += option_args(overrides)
+    if output_dir:
+        os.makedirs(os.path.dirname(out_path(ligand, output_dir)), exist_ok=True)
+        command += ["--out", out_path(ligand, output_dir)]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        returncode, output = result.returncode, result.stdout
+    except OSError as e:
+        returncode, output = 127, f"Failed to run {VINA}: {e}\n"
+    write_atomic(log_path(ligand, output_dir), output)
+    return returncode, output
+
+@functools.lru_cache(maxsize=None)
+def vina_version():
+    """The installed Vina's --version text, or "" if it cannot be run."""
+    try:
+        result = subprocess.run([VINA, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError:
+        return ""
+    return result.stdout.strip()
+
+def vina_supports_batch():
+    """True if the installed Vina accepts several ligands through --batch (Vina 1.2+)."""
+    try:
+        result = subprocess.run([VINA, "--help"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError:
+        return False
+    return "--batch" in result.stdout
+
+def log_from_poses(pose_file):
+    """Rebuild Vina's mode table from the REMARK VINA RESULT lines of an output file."""
+    rows = []
+    with open(pose_file, 'r') as f:
+        for line in f:
+            if line.startswith("REMARK VINA RESULT:"):
+                affinity, rmsd_lb, rmsd_ub = line.split(':', 1)[1].split()[:3]
+                rows.append(f"{len(rows) + 1:4d}{float(affinity):13.1f}{float(rmsd_lb):11.3f}{float(rmsd_ub):11.3f}\n")
+    header = ("mode |   affinity | dist from best mode\n"
+              "     | (kcal/mol) | rmsd l.b.| rmsd u.b.\n"
+              "-----+------------+----------+----------\n")
+    return header + ''.join(rows)
+
+def run_vina_batch(ligands, conf_file=CONF_FILE, cpu=None, output_dir=None, overrides=None):
+    """Dock several ligands in one Vina --batch run so the grid maps are built once.
+
+    Vina writes the poses of the whole batch into one directory and mixes all
+    ligands in its console output, so each ligand's _out.pdbqt is moved back
+    next to the ligand (or under output_dir) and its log is rebuilt from the
+    poses. Returns a list of
+    (ligand, return code, log text).
+    """
+    batch_dir = tempfile.mkdtemp(prefix="vina_batch_", dir='.')
+    command = [VINA, "--config", conf_file, "--dir", batch_dir]
+    for ligand in ligands:
+        command += ["--batch", ligand]
+    if cpu:
+        command += ["--cpu", str(cpu)]
+    command += option_args(overrides)
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output = result.stdout
+    except OSError as e:
+        output = f"Failed to run {VINA}: {e}\n"
+
+    results = []
+    for ligand in ligands:
+        batch_out = os.path.join(batch_dir, os.path.basename(out_path(ligand)))
+        os.makedirs(os.path.dirname(out_path(ligand, output_dir)) or '.', exist_ok=True)
+        if os.path.exists(batch_out):
+            log = log_from_poses(batch_out)
+            os.replace(batch_out, out_path(ligand, output_dir))
+            returncode = 0
+        else:
+            log = output
+            returncode = 1
+        write_atomic(log_path(ligand, output_dir), log)
+        results.append((ligand, returncode, log))
+    shutil.rmtree(batch_dir, ignore_errors=True)
+    return results
+
+def make_batches(ligands, batch_size):
+    """Group ligands into batches whose output file names cannot collide."""
+    batch, names = [], set()
+    for ligand in ligands:
+        name = os.path.basename(out_path(ligand))
+        if len(batch) >= batch_size or name in names:
+            yield batch
+            batch, names = [], set()
+        batch.append(ligand)
+        names.add(name)
+    if batch:
+        yield batch
+
+def receptor_path(conf_file=CONF_FILE):
+    """Receptor named by the receptor= option of conf_file."""
+    return read_conf(conf_file).get("receptor", "protein.pdbqt")
+
+def input_digests(ligands, conf_file=CONF_FILE, overrides=None):
+    """Map each ligand to the hashes of the ligand, receptor and conf files it is docked with.
+
+    Options overridden on the command line are folded into the conf digest.
+    """
+    conf = file_digest(conf_file)
+    if overrides:
+        text = ';'.join(f"{key}={value}" for key, value in sorted(overrides.items()))
+        conf = hashlib.sha256(f"{conf}|{text}".encode()).hexdigest()
+    shared = {"receptor": file_digest(receptor_path(conf_file)), "conf": conf}
+    return {ligand: dict(shared, ligand=file_digest(ligand)) for ligand in ligands}
+
+def master_log_entry(ligand, output):
+    """Format one ligand's section of master_log.log."""
+    return f"\n\n\n============= {ligand} Log =============\n{output}"
+
+def dock_ligands(ligands, conf_file=CONF_FILE, jobs=None, total_cpu=None, master_log=MASTER_LOG, ledger=None, cache=None, batch_size=1,
+                 append=False, output_dir=None, overrides=None, archive=None, stats=None):
+    """Dock ligands with a bounded pool of concurrent Vina processes.
+
+    The cpu= budget from conf_file (or every core if unset) is split across the
+    jobs. Each ligand gets its own log and _out.pdbqt exactly as with
+    vina_modified.pl; master_log.log collects the logs in completion order.
+
+    With a JobLedger, ligands already done with unchanged inputs are skipped,
+    every state change is recorded durably and master_log.log is appended to
+    rather than overwritten, so an interrupted run can simply be restarted.
+    With a ResultCache, ligands already docked against the same receptor and
+    box (in any directory) are copied from the cache instead of re-docked.
+    A batch_size above 1 sends that many ligands to each Vina process when the
+    installed Vina supports --batch, amortizing receptor setup for small ligands.
+    overrides replace conf.txt options (e.g. a lower exhaustiveness) and
+    output_dir moves the logs and poses under a separate folder.
+    With a LogArchive, each log is appended to the archive instead of being
+    left as its own file and master_log.log is not written at all.
+    A stats dict, if given, receives the number of cache hits as stats["cached"].
+    Returns the list of ligands whose Vina run failed.
+    """
+    overrides = {key: str(value) for key, value in (overrides or {}).items()}
+    options = dict(read_conf(conf_file), **overrides)
+    if total_cpu is None:
+        total_cpu = options.get("cpu") or default_jobs()
+    jobs, cpu_per_job = split_cpu_budget(total_cpu, jobs)
+
+    inputs = {}
+    if ledger is not None or cache is not None:
+        inputs = input_digests(ligands, conf_file, overrides)
+    if ledger is not None:
+        todo = [ligand for ligand in ligands if ledger.needs_docking(ligand, inputs[ligand])]
+        if len(todo) < len(ligands):
+            print(f"Resuming: {len(ligands) - len(todo)} ligands already docked with the same inputs")
+        ligands = todo
+        ledger.mark_many(ligands, PENDING, inputs)
+    if batch_size > 1 and not vina_supports_batch():
+        print("The installed Vina has no --batch option, docking one ligand per process.")
+        batch_size = 1
+    print(f"Docking {len(ligands)} ligands with {jobs} parallel Vina jobs, {cpu_per_job} CPU each")
+
+    def cache_key(ligand):
+        return result_key(inputs[ligand]["receptor"], inputs[ligand]["ligand"], options, vina_version())
+
+    def dock(batch):
+        if ledger is not None:
+            ledger.mark_many(batch, RUNNING, inputs)
+        results, todo = [], []
+        for ligand in batch:
+            if output_dir:
+                os.makedirs(os.path.dirname(out_path(ligand, output_dir)), exist_ok=True)
+            output = cache.get(cache_key(ligand), out_path(ligand, output_dir)) if cache is not None else None
+            if output is not None:
+                write_atomic(log_path(ligand, output_dir), output)
+                results.append((ligand, 0, output))
+                hits.append(ligand)
+            else:
+                todo.append(ligand)
+        if len(todo) > 1:
+            docked = run_vina_batch(todo, conf_file, cpu_per_job, output_dir, overrides)
+        else:
+            docked = [(ligand,) + run_vina(ligand, conf_file, cpu_per_job, output_dir, overrides) for ligand in todo]
+        for ligand, returncode, output in docked:
+            if cache is not None and returncode == 0 and os.path.exists(out_path(ligand, output_dir)):
+                cache.put(cache_key(ligand), output, out_path(ligand, output_dir))
+        return results + docked
+
+    failed, hits = [], []
+    master = open(master_log, 'a' if ledger is not None or append else 'w') if archive is None else None
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor, tqdm(total=len(ligands), desc="Docking ligands") as progress:
+            for batch, future in imap_bounded(executor, dock, make_batches(ligands, batch_size), jobs * 2):
+                if archive is not None:
+                    for ligand, _, output in future.result():
+                        archive.add(ligand, output)
+                        if os.path.exists(log_path(ligand, output_dir)):
+                            os.remove(log_path(ligand, output_dir))
+                    archive.flush()  # durable before the ledger says done
+                for ligand, returncode, output in future.result():
+                    if master is not None:
+                        master.write(master_log_entry(ligand, output))
+                    if returncode != 0:
+                        failed.append(ligand)
+                    if ledger is not None:
+                        ledger.mark(ligand, DONE if returncode == 0 else FAILED, inputs[ligand])
+                if master is not None:
+                    master.flush()
+                progress.update(len(batch))
+    finally:
+        if master is not None:
+            master.close()
+    if stats is not None:
+        stats["cached"] = len(hits)
+    if failed:
+        print(f"Vina failed for {len(failed)} ligands, see their log files for details.")
+    return failed
+
+def candidate_splits(total_cpu):
+    """(jobs, cpu_per_job) configurations worth trying for a total_cpu core budget."""
+    total_cpu = max(1, int(total_cpu))
+    cpus = [cpu for cpu in (1, 2, 4, 8, 16) if cpu <= total_cpu]
+    return [(total_cpu // cpu, cpu) for cpu in cpus]
+
+def measure_throughput(ligands, conf_file, jobs, cpu_per_job, **dock_options):
+    """Dock ligands with one (jobs, cpu_per_job) setting and return (ligands per hour, failed ligands).
+
+    Ligands served from the result cache are not counted, as they say nothing
+    about the split; the rate is None when every ligand came from the cache.
+    """
+    stats = {}
+    start = time.monotonic()
+    failed = dock_ligands(ligands, conf_file, jobs=jobs, total_cpu=jobs * cpu_per_job, append=True, stats=stats, **dock_options)
+    docked = len(ligands) - stats.get("cached", 0)
+    rate = docked * 3600 / max(time.monotonic() - start, 1e-6) if docked else None
+    return rate, failed
+
+def calibrate(ligands, conf_file, total_cpu, sample_size, **dock_options):
+    """Try every candidate split on a fresh slice of ligands and return (best split, its rate, ligands used, failed).
+
+    The calibration ligands are docked for real, so no work is thrown away.
+    The best split is None if there were no ligands to measure on.
+    """
+    rates = {}
+    used = 0
+    failed = []
+    for jobs, cpu_per_job in candidate_splits(total_cpu):
+        sample = ligands[used:used + max(sample_size, jobs * 2)]
+        if not sample:
+            break
+        used += len(sample)
+        rate, sample_failed = measure_throughput(sample, conf_file, jobs, cpu_per_job, **dock_options)
+        failed.extend(sample_failed)
+        if rate is not None:
+            rates[(jobs, cpu_per_job)] = rate
+            print(f"Calibration: {jobs} jobs x {cpu_per_job} CPU -> {rate:.0f} ligands/hour")
+    if not rates:
+        return None, None, used, failed
+    best = max(rates, key=rates.get)
+    print(f"Using {best[0]} parallel Vina jobs with {best[1]} CPU each")
+    return best, rates[best], used, failed
+
+def dock_ligands_autotuned(ligands, conf_file=CONF_FILE, total_cpu=None, sample_size=8, segment_size=None,
+                           drift=0.25, master_log=MASTER_LOG, ledger=None, **dock_options):
+    """Dock ligands with the cpu-per-job / job-count split that gives the best throughput.
+
+    A sample of ligands is docked under each candidate split first. The rest of
+    the run proceeds in segments; when a segment's throughput drifts more than
+    `drift` away from the calibrated rate (e.g. ligand sizes change through the
+    library), the splits are measured again on the next ligands.
+    Returns the list of ligands whose Vina run failed, as dock_ligands does.
+    """
+    if total_cpu is None:
+        total_cpu = read_conf(conf_file).get("cpu") or default_jobs()
+    if ledger is not None:
+        inputs = input_digests(ligands, conf_file, dock_options.get("overrides"))
+        ligands = [ligand for ligand in ligands if ledger.needs_docking(ligand, inputs[ligand])]
+    else:
+        open(master_log, 'w').close()
+    if not ligands:
+        print("All ligands already docked with the same inputs, nothing to do.")
+        return []
+    dock_options = dict(dock_options, master_log=master_log, ledger=ledger)
+    calibration_options = dict(dock_options, cache=None)
+
+    split, baseline, used, failed = calibrate(ligands, conf_file, total_cpu, sample_size, **calibration_options)
+    jobs, cpu_per_job = split or split_cpu_budget(total_cpu)
+    ligands = ligands[used:]
+    segment_size = segment_size or max(jobs * 25, 100)
+    while ligands:
+        segment, ligands = ligands[:segment_size], ligands[segment_size:]
+        rate, segment_failed = measure_throughput(segment, conf_file, jobs, cpu_per_job, **dock_options)
+        failed.extend(segment_failed)
+        if ligands and rate is not None and baseline is not None and abs(rate - baseline) > drift * baseline:
+            print(f"Throughput drifted from {baseline:.0f} to {rate:.0f} ligands/hour, recalibrating")
+            split, new_baseline, used, calibration_failed = calibrate(ligands, conf_file, total_cpu, sample_size, **calibration_options)
+            failed.extend(calibration_failed)
+            if split is not None:
+                (jobs, cpu_per_job), baseline = split, new_baseline
+            ligands = ligands[used:]
+    return failed
@@ -0,0 +1,175 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Parsing of Vina log files. A log ends with the mode table:
+
+    mode |   affinity | dist from best mode
+         | (kcal/mol) | rmsd l.b.| rmsd u.b.
+    -----+------------+----------+----------
+       1         -7.3      0.000      0.000
+       2         -7.1      1.585      2.147
+
+Only rows after the '-----+' separator are read, so header text and banner
+lines can never be mistaken for a pose.
+"""
+
+import os
+import re
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from workers import default_jobs, imap_bounded
+
+LOG_SUFFIX = ".pdbqt_log.log"
+CHUNK_SIZE = 256  # log files per task sent to a parser process
+
+TABLE_START = "-----+"
+MODE_ROW = re.compile(r"^\s*(\d+)\s+(-?\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s*$")
+MASTER_HEADER = re.compile(r"^============= (.+) Log =============$")
+
+def cid_from_log(log_file):
+    """The compound name dataan.py reports for a log or ligand path."""
+    return os.path.basename(log_file).split('.')[0]
+
+def mode_row(match):
+    return int(match.group(1)), float(match.group(2)), float(match.group(3)), float(match.group(4))
+
+def parse_mode_table(lines, first_only=False):
+    """Read (mode, affinity, rmsd l.b., rmsd u.b.) rows from an iterable of log lines.
+
+    Stops at the end of the table, or after the first row with first_only, so
+    a file object is only read as far as needed.
+    """
+    rows = []
+    in_table = False
+    for line in lines:
+        if not in_table:
+            in_table = line.startswith(TABLE_START)
+            continue
+        match = MODE_ROW.match(line)
+        if match is None:
+            break
+        rows.append(mode_row(match))
+        if first_only:
+            break
+    return rows
+
+def read_mode_table(log_file, first_only=False):
+    with open(log_file, 'r') as f:
+        return parse_mode_table(f, first_only)
+
+def best_affinity(log_file):
+    """Return (cid, best affinity) from one Vina log, or None if it has no result."""
+    rows = read_mode_table(log_file, first_only=True)
+    return (cid_from_log(log_file), rows[0][1]) if rows else None
+
+def iter_log_files(log_dir):
+    """Paths of the per-ligand Vina logs in log_dir, listed without building a glob."""
+    with os.scandir(log_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(LOG_SUFFIX) and entry.is_file():
+                yield entry.path
+
+def parse_chunk(log_files, full_table=False, keep_empty=False, key=cid_from_log):
+    """Parse a list of logs; returns (results, errors) for one pool task.
+
+    Results are (key, best affinity), or (key, mode table) with full_table,
+    where key is the CID by default. Logs without a mode table are left out
+    unless keep_empty is set (their best affinity is then None).
+    """
+    results, errors = [], []
+    for log_file in log_files:
+        try:
+            rows = read_mode_table(log_file, first_only=not full_table)
+        except (OSError, UnicodeDecodeError) as e:
+            errors.append((log_file, str(e)))
+            continue
+        if rows or keep_empty:
+            results.append((key(log_file), rows if full_table else (rows[0][1] if rows else None)))
+    return results, errors
+
+def iter_chunks(items, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def parse_logs(log_files, jobs=None, chunk_size=CHUNK_SIZE, full_table=False, on_error=None, keep_empty=False, key=cid_from_log):
+    """Parse many logs across a process pool, yielding (chunk size, results) as chunks finish.
+
+    on_error(log_file, message) is called for unreadable files. full_table,
+    keep_empty and key are passed on to parse_chunk.
+    """
+    jobs = jobs or default_jobs()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for chunk, future in imap_bounded(executor, partial(parse_chunk, full_table=full_table, keep_empty=keep_empty, key=key),
+                                          iter_chunks(log_files, chunk_size), jobs * 2):
+            results, errors = future.result()
+            if on_error is not None:
+                for log_file, message in errors:
+                    on_error(log_file, message)
+            yield len(chunk), results
+
+class MasterLogParser:
+    """Incremental reader of master_log.log: feed() it lines and it returns
+    (ligand, best affinity or mode table) as soon as an entry's result is known."""
+
+    def __init__(self, full_table=False):
+        self.full_table = full_table
+        self.ligand, self.rows, self.state = None, [], None
+
+    def feed(self, line):
+        header = MASTER_HEADER.match(line.rstrip('\n'))
+        if header is not None:
+            result = self.finish()
+            self.ligand, self.rows, self.state = header.group(1), [], "header"
+            return result
+        if self.state == "header":
+            if line.startswith(TABLE_START):
+                self.state = "table"
+        elif self.state == "table":
+            match = MODE_ROW.match(line)
+            if match is None:
+                self.state = None
+                return self.finish()
+            self.rows.append(mode_row(match))
+            if not self.full_table:
+                self.state = None  # skip the rest of this entry
+                return self.finish()
+        return None
+
+    def finish(self):
+        """The pending entry's result, if it has one; call at the end of the input."""
+        if not self.rows:
+            return None
+        result = self.ligand, self.rows if self.full_table else self.rows[0][1]
+        self.rows = []
+        return result
+
+def iter_master_log(master_log, full_table=False):
+    """Yield (ligand, best affinity or mode table) for each entry of master_log.log in one pass."""
+    parser = MasterLogParser(full_table)
+    with open(master_log, 'r') as f:
+        for line in f:
+            result = parser.feed(line)
+            if result is not None:
+                yield result
+    result = parser.finish()
+    if result is not None:
+        yield result
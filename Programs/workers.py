@@ -0,0 +1,63 @@
+#HariOm
+"""
+Copyright 2024 Manav Amit Choudhary
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+def default_jobs():
+    """Number of worker slots to use when the user does not ask for a specific count."""
+    return os.cpu_count() or 1
+
+def imap_bounded(executor, fn, items, max_in_flight):
+    """Submit fn(item) for every item, keeping at most max_in_flight futures alive.
+
+    Yields (item, future) pairs in completion order. Items are pulled lazily, so
+    very long inputs (ligand lists, SDF libraries) never sit in memory as futures.
+    """
+    max_in_flight = max(1, max_in_flight)
+    items = iter(items)
+    pending = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[executor.submit(fn, item)] = item
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+
+def imap_ordered(executor, fn, items, max_in_flight):
+    """Like imap_bounded, but yields the (item, future) pairs in input order."""
+    max_in_flight = max(1, max_in_flight)
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= max_in_flight:
+            item, future = pending.popleft()
+            future.result()
+            yield item, future
+    while pending:
+        item, future = pending.popleft()
+        future.result()
+        yield item, future
@@ -0,0 +1,130 @@
+import math
+import random
+import pytest
+import ligand_filter
+
+def molfile(atoms, bonds, title="mol"):
+    """V2000 record from [(element, (x, y, z))] and [(a, b, order[, stereo])] with one-based atoms."""
+    lines = [title, "  test", "", f"{len(atoms):3d}{len(bonds):3d}  0  0  0  0  0  0  0  0999 V2000"]
+    for element, (x, y, z) in atoms:
+        lines.append(f"{x:10.4f}{y:10.4f}{z:10.4f} {element:<3} 0  0  0  0  0  0  0  0  0  0  0  0")
+    for bond in bonds:
+        a, b, order = bond[:3]
+        stereo = bond[3] if len(bond) > 3 else 0
+        lines.append(f"{a:3d}{b:3d}{order:3d}{stereo:3d}")
+    lines.append("M  END")
+    return '\n'.join(lines) + '\n'
+
+def permuted(atoms, bonds, seed=1):
+    order = list(range(len(atoms)))
+    random.Random(seed).shuffle(order)
+    new_index = {old: new for new, old in enumerate(order)}
+    return ([atoms[old] for old in order],
+            [(new_index[b[0] - 1] + 1, new_index[b[1] - 1] + 1) + tuple(b[2:]) for b in bonds])
+
+def hash_record(record):
+    elements, charges, bonds, coords = ligand_filter.parse_connection_table(record)
+    return ligand_filter.canonical_hash(elements, charges, bonds, coords)
+
+def carbons(n):
+    return [("C", (1.5 * i, 0.0, 0.0)) for i in range(n)]
+
+DECALIN = [(1, 2, 1), (2, 3, 1), (3, 4, 1), (4, 5, 1), (5, 10, 1), (10, 1, 1), (5, 6, 1), (6, 7, 1), (7, 8, 1), (8, 9, 1), (9, 10, 1)]
+BICYCLOPENTYL = [(1, 2, 1), (2, 3, 1), (3, 4, 1), (4, 5, 1), (5, 1, 1), (1, 6, 1), (6, 7, 1), (7, 8, 1), (8, 9, 1), (9, 10, 1), (10, 6, 1)]
+
+# 2-butanol around a tetrahedral C2 at the origin; the implicit hydrogen points along (-1, -1, 1)
+TETRAHEDRAL = [(1, 1, 1), (1, -1, -1), (-1, 1, -1)]
+def butanol(mirror=False):
+    sign = -1 if mirror else 1
+    scale = 1.5 / math.sqrt(3)
+    c1, c3, o = ((sign * x * scale, y * scale, z * scale) for x, y, z in TETRAHEDRAL)
+    c4 = (c3[0] + sign * 1.5, c3[1], c3[2])
+    atoms = [("C", c1), ("C", (0.0, 0.0, 0.0)), ("C", c3), ("C", c4), ("O", o)]
+    return atoms, [(1, 2, 1), (2, 3, 1), (3, 4, 1), (2, 5, 1)]
+
+def butene(cis):
+    # CH3-CH=CH-CH3 in the xy plane
+    end = 0.9 if cis else -0.9
+    atoms = [("C", (-0.5, 0.9, 0.0)), ("C", (0.0, 0.0, 0.0)), ("C", (1.3, 0.0, 0.0)), ("C", (1.8, end, 0.0)), ("O", (1.8, -end, 0.0))]
+    return atoms, [(1, 2, 1), (2, 3, 2), (3, 4, 1), (3, 5, 1)]
+
+def test_parse_v2000_atoms_bonds_and_charges():
+    record = molfile(carbons(3), [(1, 2, 1), (2, 3, 2)]).replace("M  END", "M  CHG  1   3  -1\nM  END")
+    elements, charges, bonds, coords = ligand_filter.parse_connection_table(record)
+    assert elements == ["C", "C", "C"]
+    assert charges == [0, 0, -1]
+    assert bonds == [(0, 1, 1), (1, 2, 2)]
+    assert coords[2] == [3.0, 0.0, 0.0]
+
+def test_parse_v3000():
+    record = '\n'.join([
+        "mol", "  test", "", "  0  0  0     0  0            999 V3000",
+        "M  V30 BEGIN CTAB", "M  V30 COUNTS 2 1 0 0 0",
+        "M  V30 BEGIN ATOM", "M  V30 1 C 0 0 0 0", "M  V30 2 N 1.4 0 0 0 CHG=1", "M  V30 END ATOM",
+        "M  V30 BEGIN BOND", "M  V30 1 1 1 2", "M  V30 END BOND", "M  V30 END CTAB", "M  END", ""])
+    elements, charges, bonds, coords = ligand_filter.parse_connection_table(record)
+    assert (elements, charges, bonds) == (["C", "N"], [0, 1], [(0, 1, 1)])
+    assert coords[1] == [1.4, 0.0, 0.0]
+
+@pytest.mark.parametrize("bonds", [[(1, 2, 1), (1, 12, 1)], [(1, 2, 1), (2, 2, 1)]])
+def test_bad_bond_index_is_rejected(bonds):
+    record = molfile(carbons(10), bonds)
+    with pytest.raises(ValueError):
+        ligand_filter.parse_connection_table(record)
+    reason, digest, graph = ligand_filter.evaluate_record(record)
+    assert reason.startswith("unreadable connection table") and digest is None
+
+def test_bad_charge_index_is_rejected():
+    record = molfile(carbons(6), [(i, i + 1, 1) for i in range(1, 6)]).replace("M  END", "M  CHG  1  15   1\nM  END")
+    with pytest.raises(ValueError):
+        ligand_filter.parse_connection_table(record)
+
+def test_hash_does_not_depend_on_atom_order():
+    atoms, bonds = carbons(10), DECALIN
+    digest, graph = hash_record(molfile(atoms, bonds))
+    other_digest, other_graph = hash_record(molfile(*permuted(atoms, bonds)))
+    assert digest == other_digest
+    mapping = ligand_filter.match_atoms(graph, other_graph)
+    assert mapping is not None and sorted(mapping.values()) == list(range(10))
+
+def test_decalin_and_bicyclopentyl_collide_but_do_not_match():
+    decalin, decalin_graph = hash_record(molfile(carbons(10), DECALIN))
+    bicyclopentyl, bicyclopentyl_graph = hash_record(molfile(carbons(10), BICYCLOPENTYL))
+    assert decalin == bicyclopentyl  # refined labels alone cannot tell them apart
+    assert not ligand_filter.same_molecule(decalin_graph, bicyclopentyl_graph)
+
+def test_enantiomers_differ_and_survive_atom_reordering():
+    r_digest, r_graph = hash_record(molfile(*butanol()))
+    s_digest, s_graph = hash_record(molfile(*butanol(mirror=True)))
+    assert r_digest != s_digest
+    assert not ligand_filter.same_molecule(r_graph, s_graph)
+    assert hash_record(molfile(*permuted(*butanol())))[0] == r_digest
+
+def test_flat_record_without_wedges_has_no_stereo():
+    atoms, bonds = butanol()
+    flat = [(element, (x, y, 0.0)) for element, (x, y, _) in atoms]
+    mirrored = [(element, (-x, y, 0.0)) for element, (x, y, _) in atoms]
+    assert hash_record(molfile(flat, bonds))[0] == hash_record(molfile(mirrored, bonds))[0]
+
+def test_wedge_and_hash_give_enantiomers():
+    atoms, bonds = butanol()
+    flat = [(element, (x, y, 0.0)) for element, (x, y, _) in atoms]
+    wedge = [b + (1,) if b[:2] == (2, 5) else b for b in bonds]
+    hashed = [b + (6,) if b[:2] == (2, 5) else b for b in bonds]
+    assert hash_record(molfile(flat, wedge))[0] != hash_record(molfile(flat, hashed))[0]
+
+def test_e_and_z_isomers_differ():
+    cis, trans = hash_record(molfile(*butene(cis=True))), hash_record(molfile(*butene(cis=False)))
+    assert cis[0] != trans[0]
+    assert not ligand_filter.same_molecule(cis[1], trans[1])
+    assert hash_record(molfile(*permuted(*butene(cis=True))))[0] == cis[0]
+
+def test_prefilter_keeps_stereoisomers_and_drops_duplicates(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    records = [molfile(*butanol(), title="R"), molfile(*butanol(mirror=True), title="S"),
+               molfile(*permuted(*butanol()), title="R again")]
+    sdf = tmp_path / "library.sdf"
+    sdf.write_text(''.join(record + "$$$$\n" for record in records))
+    assert ligand_filter.prefilter_sdf_files([str(sdf)], jobs=1) == (2, 1)
+    log = (tmp_path / ligand_filter.REJECTION_LOG).read_text()
+    assert "R again: duplicate of" in log and "#1" in log
@@ -0,0 +1,98 @@
+import os
+import log_archive
+from log_archive import LogArchive, FRAME
+
+def vina_log(affinity):
+    return ("Detected 8 CPUs\nReading input ... done.\n\nmode |   affinity | dist from best mode\n"
+            "     | (kcal/mol) | rmsd l.b.| rmsd u.b.\n-----+------------+----------+----------\n"
+            f"   1       {affinity:5.1f}      0.000      0.000\nWriting output ... done.\n")
+
+def archive_with(path, logs):
+    archive = LogArchive(str(path))
+    for ligand, log in logs:
+        archive.add(ligand, log)
+    archive.flush()
+    return archive
+
+def test_round_trip_through_reopened_index(tmp_path):
+    path = tmp_path / "logs.archive"
+    logs = [(f"{cid}.pdbqt", vina_log(-5.0 - cid)) for cid in range(5)]
+    archive_with(path, logs).close()
+    archive = LogArchive(str(path))
+    assert len(archive) == 5
+    assert "3.pdbqt" in archive and "9.pdbqt" not in archive
+    assert archive.get("3.pdbqt") == vina_log(-8.0)
+    assert archive.get("9.pdbqt") is None
+    assert list(archive.items()) == logs
+    archive.close()
+
+def test_frame_format(tmp_path):
+    path = tmp_path / "logs.archive"
+    archive_with(path, [("sub/1.pdbqt", vina_log(-7.1)), ("2.pdbqt", vina_log(-6.0))]).close()
+    data = path.read_bytes()
+    name_length, data_length = FRAME.unpack_from(data)
+    assert data[FRAME.size:FRAME.size + name_length] == b"sub/1.pdbqt"
+    start = FRAME.size + name_length
+    assert log_archive.decompress(data[start:start + data_length]) == vina_log(-7.1)
+    second = start + data_length
+    name_length, data_length = FRAME.unpack_from(data, second)
+    assert data[second + FRAME.size:second + FRAME.size + name_length] == b"2.pdbqt"
+    assert second + FRAME.size + name_length + data_length == len(data)
+
+def test_recover_truncates_torn_last_record(tmp_path):
+    path = tmp_path / "logs.archive"
+    archive_with(path, [("1.pdbqt", vina_log(-7.0))]).close()
+    size = os.path.getsize(path)
+    record = log_archive.compress(vina_log(-8.0))
+    with open(path, 'ab') as f:
+        f.write(FRAME.pack(len(b"2.pdbqt"), len(record)) + b"2.pdbqt" + record[:len(record) // 2])
+    archive = LogArchive(str(path))
+    assert os.path.getsize(path) == size
+    assert len(archive) == 1 and "2.pdbqt" not in archive
+    archive.add("2.pdbqt", vina_log(-8.0))  # the next append starts cleanly after the last whole record
+    archive.close()
+    archive = LogArchive(str(path))
+    assert archive.get("1.pdbqt") == vina_log(-7.0) and archive.get("2.pdbqt") == vina_log(-8.0)
+    archive.close()
+
+def test_recover_truncates_torn_frame_header(tmp_path):
+    path = tmp_path / "logs.archive"
+    archive_with(path, [("1.pdbqt", vina_log(-7.0))]).close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(FRAME.pack(7, 100)[:3])
+    LogArchive(str(path)).close()
+    assert os.path.getsize(path) == size
+
+def test_recover_indexes_records_written_before_the_index_commit(tmp_path):
+    path = tmp_path / "logs.archive"
+    archive = archive_with(path, [("1.pdbqt", vina_log(-7.0))])
+    archive.add("2.pdbqt", vina_log(-8.0))
+    archive.add("1.pdbqt", vina_log(-9.0))
+    archive.data.flush()  # the records reached the file but the process died before committing the index
+    archive.db.close()
+    archive.data.close()
+    archive = LogArchive(str(path))
+    assert len(archive) == 2
+    assert archive.get("1.pdbqt") == vina_log(-9.0) and archive.get("2.pdbqt") == vina_log(-8.0)
+    archive.close()
+
+def test_compact_drops_superseded_records(tmp_path):
+    path = tmp_path / "logs.archive"
+    archive = archive_with(path, [("1.pdbqt", vina_log(-7.0)), ("2.pdbqt", vina_log(-6.0)), ("1.pdbqt", vina_log(-9.0))])
+    before = os.path.getsize(path)
+    archive.compact()
+    assert os.path.getsize(path) < before
+    assert not os.path.exists(str(path) + ".tmp") and not os.path.exists(str(path) + ".tmp.index")
+    assert dict(archive.items()) == {"1.pdbqt": vina_log(-9.0), "2.pdbqt": vina_log(-6.0)}
+    archive.close()
+    archive = LogArchive(str(path))
+    assert archive.get("1.pdbqt") == vina_log(-9.0) and len(archive) == 2
+    archive.close()
+
+def test_export_writes_per_ligand_logs(tmp_path):
+    archive = archive_with(tmp_path / "logs.archive", [("1.pdbqt", vina_log(-7.0)), ("sub/2.pdbqt", vina_log(-6.0))])
+    assert archive.export(str(tmp_path / "Log")) == 2
+    archive.close()
+    assert (tmp_path / "Log" / "1.pdbqt_log.log").read_text() == vina_log(-7.0)
+    assert (tmp_path / "Log" / "sub" / "2.pdbqt_log.log").read_text() == vina_log(-6.0)